@@ -0,0 +1,260 @@
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from threading import RLock
+import os
+import time
+import logging
+
+from sqlalchemy import func
+
+import models
+
+logger = logging.getLogger(__name__)
+
+POLLUTANTS = ["co2", "pm25", "pm10", "voc"]
+
+ALERT_COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "300"))
+# Fraction of the threshold the value must fall below before the same alert
+# can fire again (0 = back under the threshold). Unset disables hysteresis.
+ALERT_HYSTERESIS = os.getenv("ALERT_HYSTERESIS")
+ALERT_HYSTERESIS = float(ALERT_HYSTERESIS) if ALERT_HYSTERESIS else None
+# Disarmed entries are forgotten after this long even if no low reading arrived
+ALERT_STATE_TTL = float(os.getenv("ALERT_STATE_TTL", "86400"))
+
+
+class ThresholdIndex:
+    """In-process index of user thresholds, sorted per pollutant.
+
+    Each pollutant keeps a sorted list of (threshold, user_id) so a reading
+    resolves to every user whose threshold it exceeds with one bisect.
+    Only users with notifications enabled are indexed.
+    """
+
+    def __init__(self, max_age: float = 60.0):
+        # max_age: other uvicorn workers may write settings too, so the index
+        # is rebuilt from the database once it gets older than this (seconds)
+        self.max_age = max_age
+        self._lock = RLock()
+        self._by_pollutant = {p: [] for p in POLLUTANTS}
+        self._users = {}  # user_id -> {"email": ..., "thresholds": {...}}
+        self._loaded_at = None
+
+    def rebuild(self, db):
+        rows = db.query(
+            models.User.id,
+            models.User.email,
+            models.UserSettings.notifications,
+            models.UserSettings.thresholds,
+        ).join(models.UserSettings, models.UserSettings.user_id == models.User.id).all()
+
+        by_pollutant = {p: [] for p in POLLUTANTS}
+        users = {}
+        for row in rows:
+            if not row.notifications:
+                continue
+            thresholds = row.thresholds or {}
+            users[row.id] = {"email": row.email, "thresholds": thresholds}
+            for pollutant in POLLUTANTS:
+                threshold = _as_threshold(thresholds.get(pollutant))
+                if threshold is not None:
+                    by_pollutant[pollutant].append((threshold, row.id))
+
+        for entries in by_pollutant.values():
+            entries.sort()
+
+        with self._lock:
+            self._by_pollutant = by_pollutant
+            self._users = users
+            self._loaded_at = time.monotonic()
+        logger.info(f"Threshold index rebuilt with {len(users)} subscribed users.")
+
+    def ensure_fresh(self, db):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            self.rebuild(db)
+
+    def remove_user(self, user_id: int):
+        with self._lock:
+            if self._users.pop(user_id, None) is None:
+                return
+            for pollutant in POLLUTANTS:
+                self._by_pollutant[pollutant] = [
+                    entry for entry in self._by_pollutant[pollutant] if entry[1] != user_id
+                ]
+
+    def upsert_user(self, user_id: int, email: str, notifications: bool, thresholds: dict):
+        with self._lock:
+            self.remove_user(user_id)
+            if not notifications:
+                return
+            thresholds = thresholds or {}
+            self._users[user_id] = {"email": email, "thresholds": thresholds}
+            for pollutant in POLLUTANTS:
+                threshold = _as_threshold(thresholds.get(pollutant))
+                if threshold is not None:
+                    insort(self._by_pollutant[pollutant], (threshold, user_id))
+
+    def users_exceeding(self, pollutant: str, value: float):
+        """User ids whose threshold for `pollutant` is strictly below `value`."""
+        with self._lock:
+            entries = self._by_pollutant.get(pollutant, [])
+            end = bisect_left(entries, (value, -1))
+            return [user_id for _, user_id in entries[:end]]
+
+    def evaluate(self, reading):
+        """Map user_id -> list of exceeded pollutants for one reading.
+
+        `reading` is anything exposing the pollutant attributes
+        (schemas.SensorData or models.ArduinoData).
+        """
+        crossed = {}
+        for pollutant in POLLUTANTS:
+            value = getattr(reading, pollutant, None)
+            if not value:
+                continue
+            for user_id in self.users_exceeding(pollutant, value):
+                crossed.setdefault(user_id, []).append(pollutant)
+        return crossed
+
+    def user(self, user_id: int):
+        with self._lock:
+            return self._users.get(user_id)
+
+    def user_ids(self):
+        """Ids of every user with notifications enabled."""
+        with self._lock:
+            return list(self._users)
+
+
+class CooldownTracker:
+    """Per (user_id, pollutant) alert state, so ingest needs no alerts query.
+
+    An alert may fire when the last one for the same key is older than the
+    cooldown and, with hysteresis enabled, the value has dropped back below
+    the re-arm level since then. State is per process and rebuilt from the
+    alerts table at startup.
+    """
+
+    def __init__(self, cooldown: float = ALERT_COOLDOWN_SECONDS,
+                 hysteresis: float = ALERT_HYSTERESIS, ttl: float = ALERT_STATE_TTL):
+        self.cooldown = cooldown
+        self.hysteresis = hysteresis
+        self.ttl = max(ttl, cooldown)
+        self._lock = RLock()
+        self._last_alert = {}  # (user_id, pollutant) -> epoch seconds
+        self._disarmed = {p: {} for p in POLLUTANTS}  # pollutant -> {user_id: re-arm level}
+        self._last_evicted = 0.0
+
+    def rebuild(self, db, now: datetime = None):
+        now = now or datetime.now(timezone.utc)
+        since = _naive_utc(now) - timedelta(seconds=self.ttl)
+        rows = db.query(
+            models.Alert.user_id,
+            models.Alert.type,
+            func.max(models.Alert.timestamp).label("timestamp"),
+            func.max(models.Alert.threshold).label("threshold"),
+        ).filter(models.Alert.timestamp >= since).group_by(models.Alert.user_id, models.Alert.type).all()
+
+        last_alert = {}
+        disarmed = {p: {} for p in POLLUTANTS}
+        for row in rows:
+            last_alert[(row.user_id, row.type)] = _epoch(row.timestamp)
+            # The value since the last alert is unknown; the next low reading re-arms it
+            if self.hysteresis is not None and row.type in disarmed and row.threshold:
+                disarmed[row.type][row.user_id] = self._rearm_level(row.threshold)
+
+        with self._lock:
+            self._last_alert = last_alert
+            self._disarmed = disarmed
+        logger.info(f"Alert cooldown state rebuilt with {len(last_alert)} recent alert(s).")
+
+    def observe(self, reading):
+        """Re-arm disarmed keys whose pollutant is now below the re-arm level."""
+        with self._lock:
+            for pollutant, levels in self._disarmed.items():
+                if not levels:
+                    continue
+                value = getattr(reading, pollutant, None)
+                if value is None:
+                    continue
+                for user_id in [u for u, level in levels.items() if value < level]:
+                    del levels[user_id]
+
+    def claim(self, user_id: int, pollutant: str, threshold: float, now: datetime, claims: list = None):
+        """Record an alert for this key if one is allowed now; returns whether it was.
+
+        Successful claims are appended to `claims` so `release` can undo them
+        when the transaction writing the alerts fails.
+        """
+        key = (user_id, pollutant)
+        at = _epoch(now)
+        with self._lock:
+            self._evict(at)
+            if user_id in self._disarmed.get(pollutant, {}):
+                return False
+            last = self._last_alert.get(key)
+            if last is not None and at - last < self.cooldown:
+                return False
+            if claims is not None:
+                claims.append((key, last))
+            self._last_alert[key] = at
+            if self.hysteresis is not None and pollutant in self._disarmed:
+                self._disarmed[pollutant][user_id] = self._rearm_level(threshold)
+            return True
+
+    def release(self, claims: list):
+        """Undo claims whose alerts were rolled back, newest first."""
+        with self._lock:
+            for (user_id, pollutant), last in reversed(claims):
+                if last is None:
+                    self._last_alert.pop((user_id, pollutant), None)
+                else:
+                    self._last_alert[(user_id, pollutant)] = last
+                # A claimable key was armed before the claim
+                self._disarmed.get(pollutant, {}).pop(user_id, None)
+
+    def reset_user(self, user_id: int):
+        # New thresholds make the stored re-arm levels meaningless
+        with self._lock:
+            for levels in self._disarmed.values():
+                levels.pop(user_id, None)
+
+    def _rearm_level(self, threshold):
+        return float(threshold) * (1 - self.hysteresis)
+
+    def _evict(self, at: float):
+        if at - self._last_evicted < 60:
+            return
+        self._last_evicted = at
+        expired = [key for key, last in self._last_alert.items() if at - last >= self.ttl]
+        for user_id_pollutant in expired:
+            del self._last_alert[user_id_pollutant]
+            user_id, pollutant = user_id_pollutant
+            self._disarmed.get(pollutant, {}).pop(user_id, None)
+        # Armed keys past the cooldown carry no state worth keeping either
+        for key in [k for k, last in self._last_alert.items() if at - last >= self.cooldown]:
+            if key[0] not in self._disarmed.get(key[1], {}):
+                del self._last_alert[key]
+
+
+def _naive_utc(value: datetime):
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def _epoch(value: datetime):
+    # Alert timestamps are stored as naive UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _as_threshold(value):
+    # Missing or zero thresholds never fired before the index existed either
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        return None
+    return threshold if threshold else None
+
+
+threshold_index = ThresholdIndex()
+alert_cooldowns = CooldownTracker()
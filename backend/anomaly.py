@@ -0,0 +1,301 @@
+from copy import copy
+from datetime import datetime, timezone
+from threading import Event, Lock, Thread
+import math
+import os
+import time
+import logging
+
+import observability
+from rollups import METRICS, UNASSIGNED_DEVICE, naive
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_DETECTION = os.getenv("ANOMALY_DETECTION", "false").lower() in ("1", "true", "yes")
+# EWMA weight of the newest reading; ~1/alpha readings make up the baseline
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.05"))
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "6"))
+# Readings per series before spikes are reported
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "30"))
+# Identical consecutive values that mark a stuck sensor; ANOMALY_STUCK_READINGS_<METRIC>
+# overrides it per metric and 0 turns the check off. DHT11 temperature and humidity
+# are whole numbers that sit on one value for hours, so they are off by default.
+ANOMALY_STUCK_READINGS = int(os.getenv("ANOMALY_STUCK_READINGS", "120"))
+STUCK_READINGS = {
+    metric: int(os.getenv(f"ANOMALY_STUCK_READINGS_{metric.upper()}",
+                          "0" if metric in ("temperature", "humidity") else str(ANOMALY_STUCK_READINGS)))
+    for metric in METRICS
+}
+# A gap this many times the usual reading interval (and at least the minimum) is a dropout
+ANOMALY_DROPOUT_FACTOR = float(os.getenv("ANOMALY_DROPOUT_FACTOR", "10"))
+ANOMALY_DROPOUT_MIN_SECONDS = float(os.getenv("ANOMALY_DROPOUT_MIN_SECONDS", "300"))
+# Readings stamped further than this behind server time are backfill: they feed the
+# value baselines, but say nothing about whether the device is sending now
+ANOMALY_BACKFILL_SECONDS = float(os.getenv("ANOMALY_BACKFILL_SECONDS", "120"))
+# How often devices that stopped sending are looked for
+ANOMALY_SWEEP_SECONDS = float(os.getenv("ANOMALY_SWEEP_SECONDS", "60"))
+# Floors on the deviation, so a near-constant series is not all spikes: relative to
+# the mean, and the sensor's step (DHT11, PMS5003 and CCS811 all report whole units)
+MIN_RELATIVE_STD = 0.05
+METRIC_RESOLUTION = {metric: 1.0 for metric in METRICS}
+
+ANOMALY_DETECTIONS = observability.registry.register(observability.Counter(
+    "anomaly_detections_total", "Spikes, stuck values and dropouts detected at ingest", ("kind",)))
+
+
+class SeriesState:
+    """EWMA mean/variance and repeat count of one metric of one device."""
+    __slots__ = ("resolution", "mean", "var", "samples", "last_value", "repeats")
+
+    def __init__(self, resolution: float):
+        self.resolution = resolution
+        self.mean = None
+        self.var = 0.0
+        self.samples = 0
+        self.last_value = None
+        self.repeats = 0
+
+    def std(self):
+        return max(math.sqrt(self.var), abs(self.mean) * MIN_RELATIVE_STD, self.resolution)
+
+    def update(self, value: float, alpha: float):
+        if self.mean is None:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.var = (1 - alpha) * (self.var + diff * increment)
+        self.samples += 1
+
+
+class DeviceState:
+    __slots__ = ("last_seen", "interval", "intervals", "arrived", "silent")
+
+    def __init__(self):
+        self.last_seen = None
+        self.interval = None  # EWMA of seconds between readings
+        self.intervals = 0
+        self.arrived = None  # monotonic time the last reading came in
+        self.silent = False  # a dropout was already reported by `sweep`
+
+    def allowed_gap(self):
+        return max(self.interval * ANOMALY_DROPOUT_FACTOR, ANOMALY_DROPOUT_MIN_SECONDS)
+
+
+class AnomalyDetector:
+    """Online spike, stuck-sensor and dropout detection, O(1) state per series.
+
+    `observe(reading)` updates the state with one reading and returns its
+    detections as dicts shaped like alerts rows:
+    - "<metric>_spike": value is the reading, threshold the band edge it
+      crossed (EWMA mean +- z * deviation);
+    - "<metric>_stuck": value is the repeated reading, threshold the
+      number of identical readings seen;
+    - "dropout": value is the gap in seconds, threshold the allowed gap.
+    A device that stops sending altogether is found by `sweep()` instead,
+    and its gap is then not reported again when it comes back. Late and
+    backfilled readings (see ANOMALY_BACKFILL_SECONDS) are left out of
+    dropout detection.
+    A stuck value is reported once when its run reaches the metric's limit.
+    State is per process and warms up again after a restart.
+    """
+
+    def __init__(self, alpha: float = ANOMALY_ALPHA, z: float = ANOMALY_Z, warmup: int = ANOMALY_WARMUP,
+                 stuck_readings: dict = None):
+        self.alpha = alpha
+        self.z = z
+        self.warmup = warmup
+        self.stuck_readings = STUCK_READINGS if stuck_readings is None else stuck_readings
+        self._lock = Lock()
+        self._series = {}  # (device_id, metric) -> SeriesState
+        self._devices = {}  # device_id -> DeviceState
+
+    def observe(self, reading: dict, now: datetime = None):
+        device_id = reading.get("device_id") or UNASSIGNED_DEVICE
+        detections = []
+        with self._lock:
+            gap = self._observe_arrival(device_id, reading["timestamp"], now or datetime.now(timezone.utc))
+            if gap is not None:
+                detections.append({"type": "dropout", "value": gap[0], "threshold": gap[1]})
+            for metric in METRICS:
+                value = reading.get(metric)
+                if value is None:
+                    continue
+                detection = self._observe_value(device_id, metric, float(value))
+                if detection is not None:
+                    detections.append(detection)
+
+        for detection in detections:
+            detection["device_id"] = reading.get("device_id")
+            ANOMALY_DETECTIONS.inc(detection["type"].rsplit("_", 1)[-1])
+        return detections
+
+    def observe_many(self, readings, now: datetime = None):
+        """Detections for a batch, fed oldest first per device."""
+        now = now or datetime.now(timezone.utc)
+        detections = []
+        for reading in sorted(readings, key=lambda row: naive(row["timestamp"])):
+            detections += self.observe(reading, now)
+        return detections
+
+    def snapshot(self, readings):
+        """Copy of the state `observe_many(readings)` would change, for `restore`."""
+        devices = {reading.get("device_id") or UNASSIGNED_DEVICE for reading in readings}
+        with self._lock:
+            return {
+                "devices": {device_id: copy(self._devices.get(device_id)) for device_id in devices},
+                "series": {
+                    (device_id, metric): copy(self._series.get((device_id, metric)))
+                    for device_id in devices for metric in METRICS
+                },
+            }
+
+    def restore(self, snapshot):
+        """Put back state taken by `snapshot`, when the readings were not stored."""
+        with self._lock:
+            for states, saved in ((self._devices, snapshot["devices"]), (self._series, snapshot["series"])):
+                for key, state in saved.items():
+                    if state is None:
+                        states.pop(key, None)
+                    else:
+                        states[key] = state
+
+    def sweep(self, now: float = None):
+        """Dropout detections for devices silent past their allowed gap, once per outage."""
+        now = time.monotonic() if now is None else now
+        detections = []
+        with self._lock:
+            for device_id, state in self._devices.items():
+                if state.silent or state.arrived is None or state.intervals < self.warmup:
+                    continue
+                silence, allowed = now - state.arrived, state.allowed_gap()
+                if silence > allowed:
+                    state.silent = True
+                    detections.append({
+                        "type": "dropout",
+                        "value": silence,
+                        "threshold": allowed,
+                        "device_id": None if device_id == UNASSIGNED_DEVICE else device_id,
+                    })
+        for _ in detections:
+            ANOMALY_DETECTIONS.inc("dropout")
+        return detections
+
+    def unsweep(self, detections):
+        """Forget that `sweep` reported these dropouts, so the next sweep reports them again."""
+        with self._lock:
+            for detection in detections:
+                state = self._devices.get(detection["device_id"] or UNASSIGNED_DEVICE)
+                if state is not None:
+                    state.silent = False
+
+    def _observe_arrival(self, device_id, timestamp, now):
+        # Naive device timestamps are taken as UTC
+        utc = timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+        if (now - utc).total_seconds() > ANOMALY_BACKFILL_SECONDS:
+            return None
+        timestamp = naive(timestamp)
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = DeviceState()
+        previous = state.last_seen
+        if previous is not None and timestamp <= previous:
+            return None  # late or duplicate reading
+        state.arrived = time.monotonic()
+        reported, state.silent = state.silent, False
+        state.last_seen = timestamp
+        if previous is None:
+            return None
+
+        seconds = (timestamp - previous).total_seconds()
+        gap = None
+        if state.intervals >= self.warmup:
+            allowed = state.allowed_gap()
+            if seconds > allowed:
+                gap = (seconds, allowed)
+        if reported:
+            # The outage was already alerted on while it lasted
+            return None
+        if gap is None:
+            # The outage itself is kept out of the usual interval
+            state.interval = seconds if state.interval is None else state.interval + self.alpha * (seconds - state.interval)
+            state.intervals += 1
+        return gap
+
+    def _observe_value(self, device_id, metric, value):
+        key = (device_id, metric)
+        state = self._series.get(key)
+        if state is None:
+            state = self._series[key] = SeriesState(METRIC_RESOLUTION[metric])
+
+        detection = None
+        if value == state.last_value:
+            state.repeats += 1
+            if state.repeats == self.stuck_readings.get(metric):
+                detection = {"type": f"{metric}_stuck", "value": value, "threshold": state.repeats}
+        else:
+            state.last_value = value
+            state.repeats = 1
+
+        update = value
+        if state.samples >= self.warmup:
+            band = self.z * state.std()
+            upper, lower = state.mean + band, state.mean - band
+            if value > upper or value < lower:
+                bound = upper if value > upper else lower
+                detection = detection or {"type": f"{metric}_spike", "value": value, "threshold": bound}
+                # A spike moves the baseline only as far as the band edge
+                update = bound
+        state.update(update, self.alpha)
+        return detection
+
+    def baseline(self, device_id=None):
+        """Current mean/deviation per metric, for dashboards."""
+        device_id = device_id or UNASSIGNED_DEVICE
+        with self._lock:
+            result = {}
+            for metric in METRICS:
+                state = self._series.get((device_id, metric))
+                if state is None or state.mean is None:
+                    continue
+                result[metric] = {"mean": state.mean, "stddev": state.std(), "samples": state.samples}
+            return result
+
+
+anomaly_detector = AnomalyDetector()
+
+
+class DropoutSweeper:
+    """Background thread passing `detector.sweep()` dropouts to `raise_alerts` every `interval` seconds."""
+
+    def __init__(self, detector: AnomalyDetector, raise_alerts, interval: float = ANOMALY_SWEEP_SECONDS):
+        self.detector = detector
+        self.raise_alerts = raise_alerts
+        self.interval = interval
+        self._stop = Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            detections = self.detector.sweep()
+            if not detections:
+                continue
+            try:
+                self.raise_alerts(detections)
+            except Exception:
+                self.detector.unsweep(detections)
+                logger.exception("Raising dropout alerts failed.")
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="dropout-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -1,29 +1,26 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from threading import Lock
+import time
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 import models, schemas
-from database import SessionLocal
+from database import get_db
 import os
 from dotenv import load_dotenv
 # Config
 SECRET_KEY = os.getenv("SECRET_KEY")  # GÜVENLİK için .env'den al
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Principals resolved from the database are reused for this long (seconds)
+PRINCIPAL_CACHE_SECONDS = float(os.getenv("PRINCIPAL_CACHE_SECONDS", "60"))
 
 # Bağlantı
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -36,6 +33,15 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def create_user_token(user):
+    # uid/active let authenticated requests skip the user lookup
+    return create_access_token(data={
+        "sub": user.email,
+        "uid": user.id,
+        "active": user.is_active is not False,
+        "iat": datetime.utcnow(),
+    })
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
@@ -45,20 +51,78 @@ def authenticate_user(db: Session, email: str, password: str):
         return False
     return user
 
+class Principal:
+    """The authenticated user as handlers see it: id, email and active flag only."""
+
+    def __init__(self, id: int, email: str, is_active: bool = True):
+        self.id = id
+        self.email = email
+        self.is_active = is_active
+
+
+class PrincipalCache:
+    """Principals by token subject (email), so authenticated requests skip the users query.
+
+    Tokens carrying uid/active claims are trusted without a lookup unless
+    the subject was invalidated after the token was issued; older tokens
+    with only `sub` are resolved once per max_age. Invalidation is per
+    process, and token expiry bounds how long other workers trust claims.
+    """
+
+    def __init__(self, max_age: float = PRINCIPAL_CACHE_SECONDS):
+        self.max_age = max_age
+        self._lock = Lock()
+        self._entries = {}  # email -> (Principal, loaded_at)
+        self._invalidated = {}  # email -> epoch seconds of the last user change
+
+    def resolve(self, db: Session, payload: dict):
+        email = payload.get("sub")
+        if email is None:
+            return None
+        cached = self._entries.get(email)
+        if cached is not None and time.monotonic() - cached[1] < self.max_age:
+            return cached[0]
+
+        issued_at = payload.get("iat")
+        stale = issued_at is None or issued_at <= self._invalidated.get(email, 0)
+        if payload.get("uid") is not None and "active" in payload and not stale:
+            principal = Principal(payload["uid"], email, bool(payload["active"]))
+        else:
+            user = get_user_by_email(db, email)
+            if user is None:
+                return None
+            principal = Principal(user.id, user.email, user.is_active is not False)
+
+        with self._lock:
+            self._entries[email] = (principal, time.monotonic())
+        return principal
+
+    def invalidate(self, email: str):
+        """Call after a user is changed, deactivated or removed."""
+        with self._lock:
+            self._entries.pop(email, None)
+            self._invalidated[email] = time.time()
+
+
+principal_cache = PrincipalCache()
+
+def get_user_from_token(db: Session, token: str):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    principal = principal_cache.resolve(db, payload)
+    if principal is None or not principal.is_active:
+        return None
+    return principal
+
 def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = get_user_by_email(db, email)
+    user = get_user_from_token(db, token)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,323 @@
+"""Benchmark harness for the backend.
+
+Runs in-process against a throwaway SQLite file by default; set DATABASE_URL
+to a disposable database, or pass --base-url to hit a running server.
+
+    python benchmark.py run --users 20 --devices 10 --rate 2 --duration 15
+    python benchmark.py compare bench_results/old.json bench_results/new.json
+"""
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Thread
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+SEED_BATCH_SIZE = 5000
+# Ranges for history/summary/stats, each ending at the newest seeded reading
+RANGES = [("1h", timedelta(hours=1)), ("6h", timedelta(hours=6)), ("1d", timedelta(days=1)),
+          ("7d", timedelta(days=7)), ("30d", timedelta(days=30))]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = Lock()
+        self.latencies = []
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def record(self, seconds: float, ok: bool):
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        values = sorted(self.latencies)
+
+        def percentile(q):
+            if not values:
+                return None
+            return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))] * 1000
+
+        return {
+            "requests": len(values),
+            "errors": self.errors,
+            "throughput_rps": len(values) / elapsed if elapsed else None,
+            "p50_ms": percentile(0.50),
+            "p90_ms": percentile(0.90),
+            "p99_ms": percentile(0.99),
+            "mean_ms": sum(values) / len(values) * 1000 if values else None,
+            "max_ms": values[-1] * 1000 if values else None,
+        }
+
+
+def timed(recorder: Recorder, call, *args, **kwargs):
+    started = time.perf_counter()
+    response = call(*args, **kwargs)
+    recorder.record(time.perf_counter() - started, response.status_code < 400)
+    return response
+
+
+class SensorFleet:
+    """Synthetic Arduino units: each device follows its own random walk around typical values."""
+
+    BASELINE = {"temperature": 22.0, "humidity": 45.0, "pm25": 12.0, "pm10": 20.0, "co2": 600.0, "voc": 150.0}
+    STEP = {"temperature": 0.2, "humidity": 0.5, "pm25": 1.5, "pm10": 2.0, "co2": 15.0, "voc": 10.0}
+
+    def __init__(self, devices: int, seed: int = 42):
+        self.random = random.Random(seed)
+        self.state = [dict(self.BASELINE) for _ in range(devices)]
+
+    def reading(self, device: int, timestamp: datetime):
+        state = self.state[device]
+        for metric, step in self.STEP.items():
+            state[metric] = max(0.0, state[metric] + self.random.gauss(0, step))
+        return {"timestamp": timestamp.isoformat(), **{metric: round(value, 2) for metric, value in state.items()}}
+
+
+def register_users(client, count: int, rng: random.Random):
+    tokens = []
+    for index in range(count):
+        email = f"bench{index}@example.com"
+        client.post("/auth/register", json={"email": email, "password": "bench"})
+        token = client.post("/auth/login", data={"username": email, "password": "bench"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        # Spread thresholds so part of the fleet crosses them and the alert path runs
+        client.post("/api/settings", headers=headers, json={
+            "notifications": True,
+            "format": "metric",
+            "thresholds": {"co2": rng.uniform(600, 900), "pm25": rng.uniform(12, 35),
+                           "pm10": rng.uniform(20, 50), "voc": rng.uniform(150, 500)},
+        })
+        tokens.append(headers)
+    return tokens
+
+
+def register_devices(client, headers, count: int):
+    keys = []
+    for index in range(count):
+        response = client.post("/api/devices", headers=headers, json={"name": f"bench-{index}"})
+        keys.append(response.json()["api_key"] if response.status_code == 200 else None)
+    return keys
+
+
+def bench_ingest(client, fleet: SensorFleet, device_keys, rate: float, duration: float):
+    """Every device posts on its own thread at `rate` readings/s (0 = as fast as possible)."""
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    def run(device):
+        headers = {"X-Device-Key": device_keys[device]} if device_keys[device] else {}
+        next_at = time.monotonic()
+        while time.monotonic() < deadline:
+            payload = fleet.reading(device, datetime.now(timezone.utc))
+            timed(recorder, client.post, "/api/sensors/data", json=payload, headers=headers)
+            if rate > 0:
+                next_at += 1.0 / rate
+                time.sleep(max(0.0, next_at - time.monotonic()))
+
+    threads = [Thread(target=run, args=(device,)) for device in range(len(device_keys))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary()
+
+
+def seed_history(client, fleet: SensorFleet, rows: int, days: float, end: datetime):
+    """Backdated readings through the batch endpoint, evenly spaced over `days`."""
+    recorder = Recorder()
+    step = timedelta(days=days) / rows
+    start = end - step * rows
+    for offset in range(0, rows, SEED_BATCH_SIZE):
+        batch = [fleet.reading(0, start + step * (offset + i)) for i in range(min(SEED_BATCH_SIZE, rows - offset))]
+        timed(recorder, client.post, "/api/sensors/data/batch", json=batch)
+    summary = recorder.summary()
+    summary["rows_per_second"] = rows / (time.perf_counter() - recorder.started)
+    return summary, start, step
+
+
+def bench_queries(client, end: datetime, span: timedelta, repeat: int, max_points: int):
+    results = {}
+    for label, width in RANGES:
+        if width > span:
+            break
+        params = {"start": (end - width).isoformat(), "end": end.isoformat()}
+        cases = {
+            f"history_raw_{label}": ("/api/sensors/history", params),
+            f"history_{max_points}pts_{label}": ("/api/sensors/history", {**params, "max_points": max_points}),
+            f"summary_raw_{label}": ("/api/sensors/summary", {"start_time": params["start"], "end_time": params["end"]}),
+            f"summary_{max_points}pts_{label}": ("/api/sensors/summary", {"start_time": params["start"], "end_time": params["end"], "max_points": max_points}),
+            f"stats_{label}": ("/api/stats", {**params, "metric": "pm25"}),
+            f"stats_multi_{label}": ("/api/stats/multi", params),
+            f"stats_multi_percentiles_{label}": ("/api/stats/multi", {**params, "percentiles": "true"}),
+        }
+        for name, (path, query) in cases.items():
+            recorder = Recorder()
+            for _ in range(repeat):
+                timed(recorder, client.get, path, params=query)
+            results[name] = recorder.summary()
+    return results
+
+
+def bench_ml(client, fleet: SensorFleet, before: datetime, row_counts, repeat: int):
+    """/ml/process over freshly seeded windows ending at `before`, so every timed call has `rows` to score.
+
+    Readings are only scored once, so re-running one window would time a no-op.
+    """
+    results = {}
+    window_end = before
+    for rows in row_counts:
+        recorder = Recorder()
+        scored = 0
+        for _ in range(repeat):
+            window_start = window_end - timedelta(seconds=rows)
+            for offset in range(0, rows, SEED_BATCH_SIZE):
+                batch = [fleet.reading(0, window_start + timedelta(seconds=offset + i))
+                         for i in range(min(SEED_BATCH_SIZE, rows - offset))]
+                client.post("/api/sensors/data/batch", json=batch)
+            params = {"start_time": window_start.isoformat(),
+                      "end_time": (window_end - timedelta(seconds=1)).isoformat()}
+            response = timed(recorder, client.post, "/ml/process", params=params)
+            if response.status_code < 400:
+                scored += response.json()["scored"]
+            window_end = window_start
+        summary = recorder.summary()
+        summary["rows"] = rows
+        summary["scored"] = scored / repeat if repeat else 0
+        busy = sum(recorder.latencies)
+        summary["rows_per_second"] = scored / busy if busy else None
+        results[f"ml_process_{rows}"] = summary
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _in_process_client(database_url: str):
+    os.environ.setdefault("DATABASE_URL", database_url)
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("EMAIL_WORKER", "false")
+    for name, value in {"MAIL_USERNAME": "bench", "MAIL_PASSWORD": "bench", "MAIL_FROM": "bench@example.com",
+                        "MAIL_PORT": "25", "MAIL_SERVER": "localhost"}.items():
+        os.environ.setdefault(name, value)
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+
+    import logging
+    from fastapi.testclient import TestClient
+    import main
+
+    # Keeps per-alert INFO records out of the ingest timings
+    logging.getLogger().setLevel(logging.WARNING)
+    return TestClient(main.app)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    fleet = SensorFleet(max(args.devices, 1), args.seed)
+
+    if args.base_url:
+        import httpx
+        client = httpx.Client(base_url=args.base_url, timeout=60)
+        target = args.base_url
+    else:
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        client = _in_process_client(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        target = os.environ["DATABASE_URL"]
+
+    results = {}
+    with client:
+        headers = register_users(client, args.users, rng)
+        device_keys = register_devices(client, headers[0], args.devices) if headers else [None] * args.devices
+
+        end = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        results["seed_batch"], start, step = seed_history(client, fleet, args.seed_rows, args.seed_days, end)
+        results.update(bench_queries(client, end, timedelta(days=args.seed_days), args.repeat, args.max_points))
+        results.update(bench_ml(client, fleet, start - timedelta(days=1), args.ml_rows, args.ml_repeat))
+        results[f"ingest_{args.devices}dev_{args.users}users"] = bench_ingest(
+            client, fleet, device_keys, args.rate, args.duration
+        )
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": target,
+            "args": {key: value for key, value in vars(args).items() if key != "func"},
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, summary in results.items():
+        print(f"{name:40} p50={_ms(summary['p50_ms'])} p99={_ms(summary['p99_ms'])} "
+              f"rps={summary['throughput_rps'] or 0:.1f} errors={summary['errors']}")
+    print(f"Results written to {output}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.candidate) as f:
+        candidate = json.load(f)["results"]
+
+    for name in sorted(set(baseline) & set(candidate)):
+        line = [f"{name:40}"]
+        for key in ("p50_ms", "p99_ms"):
+            old, new = baseline[name][key], candidate[name][key]
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else "n/a"
+            line.append(f"{key[:3]} {_ms(old)} -> {_ms(new)} ({change})")
+        print("  ".join(line))
+
+
+def _ms(value):
+    return "n/a" if value is None else f"{value:.2f}ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend benchmark harness")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark and write a JSON report")
+    run_parser.add_argument("--base-url", help="benchmark a running server instead of an in-process app")
+    run_parser.add_argument("--users", type=int, default=10, help="registered users with alert thresholds")
+    run_parser.add_argument("--devices", type=int, default=5, help="simulated Arduino units posting concurrently")
+    run_parser.add_argument("--rate", type=float, default=2.0, help="readings per second per device (0 = unthrottled)")
+    run_parser.add_argument("--duration", type=float, default=10.0, help="ingest phase length in seconds")
+    run_parser.add_argument("--seed-rows", type=int, default=50000, help="backdated readings for the query phases")
+    run_parser.add_argument("--seed-days", type=float, default=30.0)
+    run_parser.add_argument("--repeat", type=int, default=20, help="requests per query case")
+    run_parser.add_argument("--max-points", type=int, default=500)
+    run_parser.add_argument("--ml-rows", type=int, nargs="+", default=[1000, 10000])
+    run_parser.add_argument("--ml-repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--output", help="report path (default bench_results/<timestamp>.json)")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare p50/p99 of two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(func=compare)
+
+    parsed = parser.parse_args()
+    parsed.func(parsed)
@@ -0,0 +1,149 @@
+from datetime import date, datetime, timedelta
+import json
+import os
+import logging
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+import models
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed for columnar exports
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports"))
+COLUMNAR_FORMATS = {"parquet": "parquet", "arrow": "arrow"}  # format -> file extension
+
+# Exported table name -> (model, primary key column, exported columns)
+EXPORT_TABLES = {
+    "arduino_data": (
+        models.ArduinoData,
+        "data_id",
+        ["data_id", "device_id", "timestamp", "temperature", "humidity", "pm25", "pm10", "co2", "voc"],
+    ),
+    "aiOutput": (
+        models.AIOutput,
+        "id",
+        ["id", "device_id", "timestamp", "temperature", "humidity", "pm25", "pm10", "prediction"],
+    ),
+}
+
+
+def available():
+    return pa is not None
+
+
+def _table_dir(table_name: str):
+    return os.path.join(EXPORT_DIR, table_name)
+
+
+def _manifest_path(table_name: str):
+    return os.path.join(_table_dir(table_name), "manifest.json")
+
+
+def load_manifest(table_name: str):
+    try:
+        with open(_manifest_path(table_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_manifest(table_name: str, manifest: dict):
+    path = _manifest_path(table_name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def partition_path(table_name: str, day: str, export_format: str):
+    # `day` is validated by the caller, so it cannot escape the export dir
+    return os.path.join(_table_dir(table_name), f"{day}.{COLUMNAR_FORMATS[export_format]}")
+
+
+def partition_signatures(db: Session, table_name: str):
+    """Row count and highest id per day, in one GROUP BY query."""
+    model, key, _ = EXPORT_TABLES[table_name]
+    day = func.date(model.timestamp)
+    rows = db.execute(
+        select(day, func.count(), func.max(getattr(model, key))).group_by(day)
+    ).all()
+    return {str(row[0])[:10]: {"rows": row[1], "max_id": row[2]} for row in rows}
+
+
+def _write_partition(db: Session, table_name: str, day: str, export_format: str):
+    model, key, columns = EXPORT_TABLES[table_name]
+    lower = datetime.combine(date.fromisoformat(day), datetime.min.time())
+    rows = db.execute(
+        select(*[getattr(model, column) for column in columns])
+        .where(model.timestamp >= lower, model.timestamp < lower + timedelta(days=1))
+        .order_by(getattr(model, key))
+    ).all()
+
+    table = pa.table({column: [row[index] for row in rows] for index, column in enumerate(columns)})
+    path = partition_path(table_name, day, export_format)
+    tmp_path = path + ".tmp"
+    if export_format == "parquet":
+        pq.write_table(table, tmp_path)
+    else:
+        feather.write_feather(table, tmp_path)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def export_table(db: Session, table_name: str, export_format: str = "parquet", full: bool = False):
+    """Write one file per day, skipping partitions that have not changed.
+
+    A partition is rewritten when it gained rows or a higher id since the
+    last export. Rows removed later (e.g. by retention) do not shrink an
+    archive that was already written.
+    """
+    if not available():
+        raise RuntimeError("pyarrow is not installed")
+
+    os.makedirs(_table_dir(table_name), exist_ok=True)
+    manifest = load_manifest(table_name)
+    exported = []
+
+    for day, signature in sorted(partition_signatures(db, table_name).items()):
+        previous = manifest.get(day)
+        unchanged = (
+            previous is not None
+            and previous.get("format") == export_format
+            and signature["rows"] <= previous["rows"]
+            and signature["max_id"] <= previous["max_id"]
+        )
+        if unchanged and not full:
+            continue
+
+        written = _write_partition(db, table_name, day, export_format)
+        manifest[day] = {
+            "rows": written,
+            "max_id": signature["max_id"],
+            "format": export_format,
+            "file": os.path.basename(partition_path(table_name, day, export_format)),
+            "exported_at": datetime.utcnow().isoformat(),
+        }
+        exported.append(day)
+        # Saved per partition so an interrupted run resumes where it stopped
+        _save_manifest(table_name, manifest)
+
+    logger.info(f"Columnar export of {table_name}: {len(exported)} partition(s) written.")
+    return exported
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        for name in EXPORT_TABLES:
+            print(name, export_table(session, name))
+    finally:
+        session.close()
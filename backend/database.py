@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base
+from observability import instrument_engine
 import os
 from dotenv import load_dotenv
 
@@ -22,8 +24,61 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     DATABASE_URL = f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
 
-engine = create_engine(DATABASE_URL)
+def _env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+# Connection pool, tuned through the environment
+pool_config = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),  # below MySQL's wait_timeout
+    "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+}
+
+def _engine_options(url):
+    # SQLite (tests, benchmarks) keeps SQLAlchemy's default pool
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return dict(pool_config)
+
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Async engine on the same database (aiomysql / asyncpg / aiosqlite)
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+if not ASYNC_DATABASE_URL:
+    url = make_url(DATABASE_URL)
+    ASYNC_DATABASE_URL = url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+_async_sessionmaker = None
+
+def get_async_sessionmaker():
+    # Created on first use so the async driver is only needed by handlers that use it
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+        instrument_engine(async_engine.sync_engine, "async")
+        _async_sessionmaker = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
 def create_database_tables():
     Base.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Optional
+import hashlib
+import os
+import secrets
+import time
+
+from fastapi import Depends, Header, HTTPException
+from sqlalchemy.orm import Session
+
+import models
+from database import get_db
+
+# Off by default so firmware that posts without a key keeps working
+DEVICE_AUTH_REQUIRED = os.getenv("DEVICE_AUTH_REQUIRED", "false").lower() in ("1", "true", "yes")
+DEVICE_KEY_CACHE_SECONDS = 60
+LAST_SEEN_INTERVAL = 60
+
+
+def generate_api_key():
+    return secrets.token_urlsafe(32)
+
+
+def hash_api_key(api_key: str):
+    # Keys are random, so an unsalted digest is enough and stays indexable
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class DeviceKeyCache:
+    """api key hash -> active device id, so ingest skips the devices lookup on most posts."""
+
+    def __init__(self, max_age: float = DEVICE_KEY_CACHE_SECONDS):
+        self.max_age = max_age
+        self._lock = Lock()
+        self._entries = {}  # key hash -> (device_id or None, loaded_at)
+        self._last_seen = {}  # device_id -> monotonic time of the last last_seen_at write
+
+    def resolve(self, db: Session, api_key: str):
+        key_hash = hash_api_key(api_key)
+        now = time.monotonic()
+        cached = self._entries.get(key_hash)
+        if cached is not None and now - cached[1] < self.max_age:
+            return cached[0]
+
+        device = db.query(models.Device).filter(models.Device.api_key_hash == key_hash).first()
+        device_id = device.id if device is not None and device.is_active else None
+        with self._lock:
+            self._entries[key_hash] = (device_id, now)
+        return device_id
+
+    def touch(self, db: Session, device_id: int):
+        # last_seen_at is written at most once a minute per device
+        now = time.monotonic()
+        if now - self._last_seen.get(device_id, 0.0) < LAST_SEEN_INTERVAL:
+            return
+        self._last_seen[device_id] = now
+        db.query(models.Device).filter(models.Device.id == device_id).update(
+            {"last_seen_at": datetime.now(timezone.utc)}, synchronize_session=False
+        )
+        db.commit()
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = {}
+
+
+device_keys = DeviceKeyCache()
+
+
+def get_ingest_device_id(
+    x_device_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Device id for an ingest request, from the X-Device-Key header."""
+    if not x_device_key:
+        if DEVICE_AUTH_REQUIRED:
+            raise HTTPException(status_code=401, detail="Missing device key")
+        return None
+
+    device_id = device_keys.resolve(db, x_device_key)
+    if device_id is None:
+        raise HTTPException(status_code=401, detail="Invalid device key")
+    device_keys.touch(db, device_id)
+    return device_id
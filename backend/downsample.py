@@ -0,0 +1,210 @@
+from datetime import datetime, timedelta
+import re
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+import models
+from rollups import RESOLUTIONS, device_filter, naive, retained_pieces
+
+MAX_POINTS_LIMIT = 5000
+MODES = ("avg", "minmax", "lttb")
+# LTTB picks points out of an averaged series this many times denser than the target
+LTTB_OVERSAMPLE = 8
+
+EPOCH = datetime(1970, 1, 1)
+_RESOLUTION_PATTERN = re.compile(r"^(\d+)\s*([smhd]?)$")
+_UNIT_SECONDS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_resolution(value: str) -> timedelta:
+    """'30s', '5m', '1h', '1d' or a plain number of seconds."""
+    match = _RESOLUTION_PATTERN.match(value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid resolution: {value}")
+    return timedelta(seconds=int(match.group(1)) * _UNIT_SECONDS[match.group(2)])
+
+
+def data_range(db: Session, device_id=None):
+    query = db.query(func.min(models.ArduinoData.timestamp), func.max(models.ArduinoData.timestamp))
+    if device_id is not None:
+        query = query.filter(device_filter(models.ArduinoData, device_id))
+    return query.one()
+
+
+def point_limit(max_points=None):
+    return min(max_points or MAX_POINTS_LIMIT, MAX_POINTS_LIMIT)
+
+
+def bucket_width(start, end, max_points=None, resolution=None) -> timedelta:
+    # Epoch-aligned buckets of span / (n - 1) cover the span in at most n buckets
+    width = (end - start) / max(point_limit(max_points) - 1, 1)
+    if resolution:
+        width = max(width, resolution)
+    # Whole seconds, at least one
+    return timedelta(seconds=max(1, -(-width // timedelta(seconds=1))))
+
+
+def _floor_to(ts, width: timedelta):
+    return EPOCH + ((ts - EPOCH) // width) * width
+
+
+def _pick_source(width: timedelta):
+    """Coarsest rollup whose buckets fit inside `width` (None means raw rows)."""
+    source = None
+    step = None
+    for rollup, _, rollup_step in RESOLUTIONS:
+        if rollup_step <= width:
+            source, step = rollup, rollup_step
+    return source, step
+
+
+def bucket_series(db: Session, start, end, width: timedelta, metrics, with_minmax=False, device_id=None,
+                  max_points=None):
+    """Average (and optionally min/max) of each metric per `width` bucket, oldest first.
+
+    Full rollup buckets are read when the width allows it, so the rows
+    scanned depend on the range and width, not on the raw reading rate.
+    Rollup buckets overlapping the range edges are taken whole, and past
+    a retention horizon the series continues at the coarser resolution.
+    Those edge buckets can add to the count, so beyond `max_points` the
+    oldest buckets are folded into their neighbours.
+    """
+    start, end = naive(start), naive(end)
+    source, step = _pick_source(width)
+    if step:
+        # Output buckets must be made of whole source buckets
+        width = -(-width // step) * step
+
+    buckets = {}
+
+    def bucket_for(ts):
+        key = _floor_to(naive(ts), width)
+        acc = buckets.get(key)
+        if acc is None:
+            acc = buckets[key] = {"timestamp": key, "count": 0}
+            for metric in metrics:
+                acc[f"{metric}_sum"] = 0.0
+                acc[f"{metric}_min"] = None
+                acc[f"{metric}_max"] = None
+        return acc
+
+    def fold(acc, metric, total, low, high):
+        acc[f"{metric}_sum"] += total
+        if acc[f"{metric}_min"] is None or low < acc[f"{metric}_min"]:
+            acc[f"{metric}_min"] = low
+        if acc[f"{metric}_max"] is None or high > acc[f"{metric}_max"]:
+            acc[f"{metric}_max"] = high
+
+    def read_raw(lower, upper, inclusive):
+        columns = [getattr(models.ArduinoData, metric) for metric in metrics]
+        ts = models.ArduinoData.timestamp
+        query = select(ts, *columns).where(ts >= lower, ts <= upper if inclusive else ts < upper)
+        if device_id is not None:
+            query = query.where(device_filter(models.ArduinoData, device_id))
+        for row in db.execute(query):
+            acc = bucket_for(row[0])
+            acc["count"] += 1
+            for index, metric in enumerate(metrics, start=1):
+                fold(acc, metric, row[index], row[index], row[index])
+
+    def read_rollup(rollup, lower, upper, inclusive):
+        columns = []
+        for metric in metrics:
+            columns += [
+                getattr(rollup, f"{metric}_sum"),
+                getattr(rollup, f"{metric}_min"),
+                getattr(rollup, f"{metric}_max"),
+            ]
+        upper_clause = rollup.bucket <= upper if inclusive else rollup.bucket < upper
+        query = select(rollup.bucket, rollup.count, *columns).where(rollup.bucket >= lower, upper_clause)
+        if device_id is not None:
+            query = query.where(rollup.device_id == device_id)
+        for row in db.execute(query):
+            acc = bucket_for(row[0])
+            acc["count"] += row[1]
+            for index, metric in enumerate(metrics):
+                total, low, high = row[2 + index * 3:5 + index * 3]
+                fold(acc, metric, total, low, high)
+
+    lower = _floor_to(start, step) if step else start
+    # Ranges older than the source's retention horizon come from coarser rollups
+    pieces = retained_pieces(source, lower, end)
+    for index, (piece_source, piece_lower, piece_upper) in enumerate(pieces):
+        inclusive = index == len(pieces) - 1
+        if piece_source is None:
+            read_raw(piece_lower, piece_upper, inclusive)
+        else:
+            read_rollup(piece_source, piece_lower, piece_upper, inclusive)
+
+    keys = sorted(buckets)
+    while max_points and len(keys) > max_points:
+        oldest = buckets.pop(keys.pop(0))
+        acc = buckets[keys[0]]
+        acc["count"] += oldest["count"]
+        for metric in metrics:
+            fold(acc, metric, oldest[f"{metric}_sum"], oldest[f"{metric}_min"], oldest[f"{metric}_max"])
+
+    series = []
+    for key in keys:
+        acc = buckets[key]
+        point = {"timestamp": key, "samples": acc["count"]}
+        for metric in metrics:
+            point[metric] = acc[f"{metric}_sum"] / acc["count"]
+            if with_minmax:
+                point[f"{metric}_min"] = acc[f"{metric}_min"]
+                point[f"{metric}_max"] = acc[f"{metric}_max"]
+        series.append(point)
+    return series
+
+
+def lttb(points, threshold: int, metric: str):
+    """Largest-Triangle-Three-Buckets selection of `threshold` points by `metric`."""
+    if threshold >= len(points):
+        return list(points)
+    if threshold < 3:
+        # No middle buckets to choose between; keep the ends
+        return [points[0], points[-1]][:max(threshold, 0)]
+
+    xs = [(point["timestamp"] - EPOCH).total_seconds() for point in points]
+    ys = [point[metric] for point in points]
+    selected = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        best_area = -1.0
+        best = range_start
+        for j in range(range_start, range_end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best_area = area
+                best = j
+        selected.append(points[best])
+        a = best
+
+    selected.append(points[-1])
+    return selected
+
+
+def downsample(db: Session, start, end, metrics, max_points=None, resolution=None, mode="avg", lttb_metric="pm25",
+               device_id=None):
+    """Bounded chart series for [start, end], newest first like the raw endpoints."""
+    target = point_limit(max_points)
+    if mode == "lttb":
+        width = bucket_width(naive(start), naive(end), target * LTTB_OVERSAMPLE, resolution)
+        series = lttb(bucket_series(db, start, end, width, metrics, device_id=device_id), target, lttb_metric)
+    else:
+        width = bucket_width(naive(start), naive(end), target, resolution)
+        series = bucket_series(db, start, end, width, metrics, with_minmax=mode == "minmax", device_id=device_id,
+                               max_points=target)
+    series.reverse()
+    return series
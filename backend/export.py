@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+
+from sqlalchemy import select, or_, and_
+
+import models
+from database import SessionLocal
+from rollups import device_filter
+
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FORMATS = ("ndjson", "csv")
+SENSOR_FIELDS = ["data_id", "device_id", "timestamp", "temperature", "humidity", "pm25", "pm10", "co2", "voc"]
+
+
+def iter_reading_pages(start=None, end=None, chunk_size: int = EXPORT_CHUNK_SIZE, device_id=None):
+    """Yield lists of arduino_data rows ordered by (timestamp, data_id).
+
+    Pages are fetched with keyset pagination on a dedicated session, so
+    memory stays bounded by one page whatever the range, and each query
+    can use the timestamp index instead of an ever-growing OFFSET.
+    """
+    table = models.ArduinoData
+    columns = [getattr(table, field) for field in SENSOR_FIELDS]
+    db = SessionLocal()
+    try:
+        last_ts = last_id = None
+        while True:
+            query = select(*columns).order_by(table.timestamp, table.data_id).limit(chunk_size)
+            if start is not None:
+                query = query.where(table.timestamp >= start)
+            if end is not None:
+                query = query.where(table.timestamp <= end)
+            if device_id is not None:
+                query = query.where(device_filter(table, device_id))
+            if last_ts is not None:
+                query = query.where(or_(
+                    table.timestamp > last_ts,
+                    and_(table.timestamp == last_ts, table.data_id > last_id)
+                ))
+
+            page = db.execute(query).all()
+            if not page:
+                break
+            yield page
+            last_ts, last_id = page[-1].timestamp, page[-1].data_id
+            if len(page) < chunk_size:
+                break
+    finally:
+        db.close()
+
+
+def ndjson_chunks(pages):
+    for page in pages:
+        yield "".join(
+            json.dumps({
+                field: row.timestamp.isoformat() if field == "timestamp" else getattr(row, field)
+                for field in SENSOR_FIELDS
+            }) + "\n"
+            for row in page
+        )
+
+
+def csv_chunks(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SENSOR_FIELDS)
+    for page in pages:
+        for row in page:
+            writer.writerow([row.timestamp.isoformat() if field == "timestamp" else getattr(row, field)
+                             for field in SENSOR_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    # Header still goes out for an empty range
+    if buffer.tell():
+        yield buffer.getvalue()
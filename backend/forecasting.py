@@ -0,0 +1,287 @@
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+import argparse
+import math
+import os
+import logging
+
+import joblib
+import numpy as np
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+import models, schemas
+from database import SessionLocal
+from latest_cache import LatestCache
+from ml_model import ModelRegistry
+from ml_scoring import classifier_features, get_season, predict_batch
+from rollups import floor_hour, naive
+
+logger = logging.getLogger(__name__)
+
+FORECAST_MODEL_PATH = os.getenv(
+    "FORECAST_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "forecast_model.pkl")
+)
+# Runs every interval once a trained model exists
+FORECAST_SCHEDULER = os.getenv("FORECAST_SCHEDULER", "true").lower() in ("1", "true", "yes")
+FORECAST_INTERVAL_SECONDS = float(os.getenv("FORECAST_INTERVAL_SECONDS", "600"))
+# Hourly buckets that must exist in the feature window before a device gets a forecast
+FORECAST_MIN_HOURS = int(os.getenv("FORECAST_MIN_HOURS", "12"))
+MIN_TRAINING_SAMPLES = 50
+
+HORIZONS = range(1, 7)
+TARGETS = ["pm25", "pm10"]
+FEATURE_METRICS = ["pm25", "pm10", "temperature", "humidity"]
+LAGS = (0, 1, 2, 3, 6, 12, 23)
+WINDOW_HOURS = 24
+
+forecast_registry = ModelRegistry(FORECAST_MODEL_PATH)
+
+
+def hourly_means(row):
+    return {metric: getattr(row, f"{metric}_sum") / row.count for metric in FEATURE_METRICS}
+
+
+def feature_vector(series: dict, anchor: datetime):
+    """Lag and rolling features of the WINDOW_HOURS hours ending at `anchor`.
+
+    `series` maps hour bucket -> hourly means. Missing hours are filled
+    forward; None when the anchor hour or too much of the window is missing.
+    """
+    hours = [anchor - timedelta(hours=k) for k in range(WINDOW_HOURS - 1, -1, -1)]  # oldest first
+    if anchor not in series or sum(hour in series for hour in hours) < FORECAST_MIN_HOURS:
+        return None
+
+    filled = []
+    last = next(series[hour] for hour in hours if hour in series)
+    for hour in hours:
+        last = series.get(hour, last)
+        filled.append(last)
+    filled.reverse()  # newest first, so lag k is filled[k]
+
+    features = []
+    for metric in FEATURE_METRICS:
+        column = np.array([means[metric] for means in filled])
+        features += [column[lag] for lag in LAGS]
+        features += [column[:6].mean(), column.mean(), column.std()]
+    angle = 2 * math.pi * anchor.hour / 24
+    features += [math.sin(angle), math.cos(angle), get_season(anchor.month)]
+    return features
+
+
+def _feature(features, metric: str, lag: int = 0):
+    # Each metric contributes its lags followed by three rolling statistics
+    return features[FEATURE_METRICS.index(metric) * (len(LAGS) + 3) + LAGS.index(lag)]
+
+
+class HourlyWindowCache:
+    """Last WINDOW_HOURS hourly means per rollup device, topped up from arduino_rollup_1h.
+
+    Each run only reads buckets from the newest cached one on (it may have
+    grown since), so features are not recomputed from raw readings.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._windows = {}  # device_id -> {bucket: means}
+
+    def refresh(self, db: Session, device_id: int, anchor: datetime):
+        """Hourly means of the WINDOW_HOURS ending at `anchor`, plus any newer cached buckets."""
+        rollup = models.SensorRollupHour
+        # Same window feature_vector reads, so served features match the training ones
+        oldest = anchor - timedelta(hours=WINDOW_HOURS - 1)
+        with self._lock:
+            window = self._windows.get(device_id, {})
+            since = max(max(window), oldest) if window else oldest
+            rows = db.query(rollup).filter(rollup.device_id == device_id, rollup.bucket >= since).all()
+            window = {bucket: means for bucket, means in window.items() if bucket >= oldest}
+            for row in rows:
+                window[row.bucket] = hourly_means(row)
+            self._windows[device_id] = window
+            return dict(window)
+
+
+window_cache = HourlyWindowCache()
+
+
+def _anchor(latest_bucket: datetime, now: datetime):
+    # The current hour's bucket is still filling up
+    current_hour = floor_hour(naive(now))
+    return latest_bucket if latest_bucket < current_hour else latest_bucket - timedelta(hours=1)
+
+
+def run_forecasts(db: Session, now: datetime = None):
+    """Issue forecasts for devices with a newer complete hour than their last forecast.
+
+    Returns None when no trained model exists yet.
+    """
+    if not os.path.exists(forecast_registry.path):
+        return None
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    rollup = models.SensorRollupHour
+
+    latest = db.query(rollup.device_id, func.max(rollup.bucket)).group_by(rollup.device_id).all()
+    issued = dict(db.query(models.AIForecast.device_id, func.max(models.AIForecast.issued_at))
+                  .group_by(models.AIForecast.device_id).all())
+
+    pending = []
+    for device_id, latest_bucket in latest:
+        anchor = _anchor(latest_bucket, now)
+        if issued.get(device_id) is not None and issued[device_id] >= anchor:
+            continue
+        features = feature_vector(window_cache.refresh(db, device_id, anchor), anchor)
+        if features is not None:
+            pending.append((device_id, anchor, features))
+    if not pending:
+        return {"issued": 0}
+
+    predicted = forecast_registry.predict(np.array([features for _, _, features in pending], dtype=float))
+
+    # Forecast pollutants go through the existing category classifier, with the
+    # latest temperature and humidity carried forward
+    rows = []
+    classify = []
+    for (device_id, anchor, features), outputs in zip(pending, predicted):
+        temperature = _feature(features, "temperature")
+        humidity = _feature(features, "humidity")
+        for horizon in HORIZONS:
+            target_time = anchor + timedelta(hours=horizon)
+            pm25 = float(outputs[TARGETS.index("pm25") * len(HORIZONS) + horizon - 1])
+            pm10 = float(outputs[TARGETS.index("pm10") * len(HORIZONS) + horizon - 1])
+            rows.append({
+                "device_id": device_id,
+                "issued_at": anchor,
+                "horizon": horizon,
+                "target_time": target_time,
+                "pm25": pm25,
+                "pm10": pm10,
+            })
+            classify.append(classifier_features(temperature, humidity, pm25, pm10, target_time))
+
+    for row, label in zip(rows, predict_batch(np.array(classify, dtype=float))):
+        row["prediction"] = label
+    db.execute(insert(models.AIForecast), rows)
+    db.commit()
+    latest_forecast.invalidate()
+    return {"issued": len(pending), "rows": len(rows)}
+
+
+def _load_latest_forecast(db: Session, device_id=None):
+    forecast = models.AIForecast
+    query = db.query(forecast.device_id, forecast.issued_at)
+    if device_id is not None:
+        query = query.filter(forecast.device_id == device_id)
+    newest = query.order_by(forecast.issued_at.desc()).first()
+    if newest is None:
+        return None
+
+    points = db.query(forecast).filter(
+        forecast.device_id == newest.device_id, forecast.issued_at == newest.issued_at
+    ).order_by(forecast.horizon).all()
+    return schemas.Forecast(
+        device_id=newest.device_id,
+        issued_at=newest.issued_at,
+        forecasts=[schemas.ForecastPoint.model_validate(point, from_attributes=True) for point in points]
+    )
+
+
+latest_forecast = LatestCache(_load_latest_forecast, schemas.Forecast)
+
+
+# Training
+
+def build_training_set(db: Session):
+    """(features, targets) for every hour with a full feature window and all horizons ahead."""
+    rollup = models.SensorRollupHour
+    features, targets = [], []
+    for (device_id,) in db.query(rollup.device_id).distinct().all():
+        series = {
+            row.bucket: hourly_means(row)
+            for row in db.query(rollup).filter(rollup.device_id == device_id).order_by(rollup.bucket)
+        }
+        for anchor in series:
+            ahead = [series.get(anchor + timedelta(hours=horizon)) for horizon in HORIZONS]
+            if any(means is None for means in ahead):
+                continue
+            vector = feature_vector(series, anchor)
+            if vector is None:
+                continue
+            features.append(vector)
+            targets.append([means[target] for target in TARGETS for means in ahead])
+    return np.array(features, dtype=float), np.array(targets, dtype=float)
+
+
+def train(db: Session, n_estimators: int = 100, path: str = FORECAST_MODEL_PATH):
+    """Fit a multi-output RandomForestRegressor and swap it in atomically."""
+    from sklearn.ensemble import RandomForestRegressor
+
+    features, targets = build_training_set(db)
+    if len(features) < MIN_TRAINING_SAMPLES:
+        raise ValueError(f"Only {len(features)} training samples; at least {MIN_TRAINING_SAMPLES} hours are needed")
+
+    model = RandomForestRegressor(n_estimators=n_estimators, min_samples_leaf=2, n_jobs=-1, random_state=0)
+    model.fit(features, targets)
+    # The registry reloads on mtime change, so it must never see a half-written file
+    partial = f"{path}.tmp"
+    joblib.dump(model, partial)
+    os.replace(partial, path)
+    logger.info(f"Forecast model trained on {len(features)} samples and saved to {path}")
+    return {"samples": len(features), "path": path}
+
+
+class ForecastScheduler:
+    """Background thread issuing forecasts every `interval` seconds."""
+
+    def __init__(self, interval: float = FORECAST_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                result = run_forecasts(db)
+                if result and result["issued"]:
+                    logger.info(f"Forecasts issued: {result}")
+            except Exception:
+                db.rollback()
+                logger.exception("Forecast run failed.")
+            finally:
+                db.close()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="forecast", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+forecast_scheduler = ForecastScheduler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the forecast model or issue forecasts once")
+    commands = parser.add_subparsers(dest="command", required=True)
+    training = commands.add_parser("train", help="fit the model on arduino_rollup_1h")
+    training.add_argument("--estimators", type=int, default=100)
+    commands.add_parser("run", help="issue forecasts for devices with new complete hours")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    session = SessionLocal()
+    try:
+        if args.command == "train":
+            print(train(session, args.estimators))
+        else:
+            print(run_forecasts(session))
+    finally:
+        session.close()
@@ -0,0 +1,147 @@
+from threading import Event, Thread
+import json
+import os
+import queue
+import time
+import logging
+
+import observability
+
+logger = logging.getLogger(__name__)
+
+# Write-behind mode acknowledges a reading once it is buffered; off by default
+INGEST_WRITE_BEHIND = os.getenv("INGEST_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+INGEST_BUFFER_SIZE = int(os.getenv("INGEST_BUFFER_SIZE", "10000"))
+INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "500"))
+INGEST_FLUSH_MS = float(os.getenv("INGEST_FLUSH_MS", "200"))
+# How long a request waits for room in a full buffer before it is rejected
+INGEST_ENQUEUE_TIMEOUT = float(os.getenv("INGEST_ENQUEUE_TIMEOUT", "1"))
+FLUSH_RETRY_SECONDS = 1.0
+# A batch still failing after this many retries (backing off from FLUSH_RETRY_SECONDS)
+# is appended to the dead-letter file instead of blocking the buffer
+INGEST_FLUSH_RETRIES = int(os.getenv("INGEST_FLUSH_RETRIES", "5"))
+INGEST_DEAD_LETTER_PATH = os.getenv("INGEST_DEAD_LETTER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_dead_letter.jsonl"))
+
+DEAD_LETTER_ROWS = observability.registry.register(observability.Counter(
+    "ingest_dead_letter_rows_total", "Buffered readings moved to the dead-letter file after failed flushes"))
+
+
+class BufferFull(Exception):
+    pass
+
+
+class IngestBuffer:
+    """Bounded in-process buffer of readings, group-committed by one flusher thread.
+
+    `flush(rows)` writes and commits a list of reading dicts. A batch is
+    flushed once it has `flush_rows` rows or its first row has waited
+    `flush_ms`. A failed flush is retried, so a short database outage fills
+    the buffer and producers get BufferFull instead of losing readings
+    silently; a batch that keeps failing is moved to the dead-letter file.
+    """
+
+    def __init__(self, flush, max_size: int = INGEST_BUFFER_SIZE,
+                 flush_rows: int = INGEST_FLUSH_ROWS, flush_ms: float = INGEST_FLUSH_MS):
+        self.flush = flush
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_ms / 1000
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop = Event()
+        self._thread = None
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def put(self, row: dict, timeout: float = INGEST_ENQUEUE_TIMEOUT):
+        if self._thread is None or self._stop.is_set():
+            raise BufferFull("Ingest buffer is not accepting readings")
+        try:
+            self._queue.put(row, timeout=timeout)
+        except queue.Full:
+            raise BufferFull()
+
+    def _collect(self):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.flush_rows:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        delay = FLUSH_RETRY_SECONDS
+        for attempt in range(INGEST_FLUSH_RETRIES + 1):
+            try:
+                self.flush(batch)
+            except Exception:
+                logger.exception(f"Flushing {len(batch)} buffered reading(s) failed (attempt {attempt + 1}).")
+                if self._stop.is_set():
+                    break
+                if attempt < INGEST_FLUSH_RETRIES:
+                    self._stop.wait(delay)
+                    delay *= 2
+                continue
+            self.flushed_rows += len(batch)
+            self.flushed_batches += 1
+            return
+        self._dead_letter(batch)
+
+    def _dead_letter(self, batch):
+        """Append an unwritable batch as JSON lines, for replay once the cause is fixed."""
+        DEAD_LETTER_ROWS.inc(amount=len(batch))
+        try:
+            with open(INGEST_DEAD_LETTER_PATH, "a", encoding="utf-8") as file:
+                for row in batch:
+                    file.write(json.dumps(row, default=str) + "\n")
+        except OSError:
+            logger.exception(f"Dropping {len(batch)} buffered reading(s); the dead-letter file is not writable.")
+            return
+        logger.error(f"Moved {len(batch)} buffered reading(s) to {INGEST_DEAD_LETTER_PATH} after failed flushes.")
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        # Shutdown: whatever was acknowledged still gets written
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._write(batch)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="ingest-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info(f"Ingest buffer stopped after {self.flushed_rows} row(s) in {self.flushed_batches} batch(es).")
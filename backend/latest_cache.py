@@ -0,0 +1,102 @@
+from threading import Lock
+import hashlib
+import json
+import os
+import time
+
+import models, schemas
+from rollups import UNASSIGNED_DEVICE, device_filter, naive
+
+# Other workers write too; an entry is re-read from the database after this long
+LATEST_CACHE_MAX_AGE = float(os.getenv("LATEST_CACHE_MAX_AGE", "10"))
+
+
+class CachedEntry:
+    def __init__(self, data: dict):
+        self.data = data
+        self.body = json.dumps(data, default=_json_default).encode()
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:20] + '"'
+        self.loaded_at = time.monotonic()
+
+
+class LatestCache:
+    """Newest row of one table, overall and per device, kept in memory and refreshed on write.
+
+    `loader(db, device_id)` returns the newest row (or None) and is only
+    called on a cold or expired entry; device_id None means any device.
+    Loaded and written rows both go through `schema` with a naive
+    timestamp, and the ETag is a hash of that body, so it matches across
+    workers serving the same row.
+    """
+
+    def __init__(self, loader, schema, max_age: float = LATEST_CACHE_MAX_AGE):
+        self.loader = loader
+        self.schema = schema
+        self.max_age = max_age
+        self._lock = Lock()
+        self._entries = {}  # device_id (None = all devices) -> CachedEntry
+
+    def fresh(self, device_id=None):
+        """The cached entry if it is still within max_age, without touching the database."""
+        entry = self._entries.get(device_id)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.max_age:
+            return entry
+        return None
+
+    def get(self, db, device_id=None):
+        entry = self.fresh(device_id)
+        if entry is not None:
+            return entry
+
+        row = self.loader(db, device_id)
+        if row is None:
+            return None
+        entry = self._entry(row)
+        with self._lock:
+            self._entries[device_id] = entry
+        return entry
+
+    def _entry(self, row):
+        data = self.schema.model_validate(row).model_dump()
+        if "timestamp" in data:
+            data["timestamp"] = naive(data["timestamp"])
+        return CachedEntry(data)
+
+    def put(self, row):
+        entry = self._entry(row)
+        device_id = entry.data.get("device_id")
+        with self._lock:
+            # Readings without a device are also what device 0 serves
+            for key in {None, UNASSIGNED_DEVICE if device_id is None else device_id}:
+                # Backfilled batches may carry older device timestamps
+                current = self._entries.get(key)
+                if current is not None and current.data["timestamp"] > entry.data["timestamp"]:
+                    continue
+                self._entries[key] = entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = {}
+
+
+def _json_default(value):
+    return value.isoformat()
+
+
+def _newest(db, model, device_id):
+    query = db.query(model)
+    if device_id is not None:
+        query = query.filter(device_filter(model, device_id))
+    return query.order_by(model.timestamp.desc()).first()
+
+
+def _load_latest_reading(db, device_id=None):
+    return _newest(db, models.ArduinoData, device_id)
+
+
+def _load_latest_prediction(db, device_id=None):
+    return _newest(db, models.AIOutput, device_id)
+
+
+latest_reading = LatestCache(_load_latest_reading, schemas.SensorData)
+latest_prediction = LatestCache(_load_latest_prediction, schemas.AIOutput)
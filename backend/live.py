@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+import anyio
+from fastapi import WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+
+
+class Subscriber:
+    def __init__(self, loop, user_id=None):
+        self.loop = loop
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def offer(self, event):
+        # Slow clients lose their oldest events instead of blocking ingest
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(event)
+
+
+class Broadcaster:
+    """In-process pub/sub for live readings and alerts.
+
+    Events without a user_id go to every subscriber; alert events carry the
+    owner's user_id and only reach that user's authenticated streams.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, user_id=None):
+        subscriber = Subscriber(asyncio.get_running_loop(), user_id)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, data: dict, user_id=None):
+        if not self._subscribers:
+            return
+        event = {"event": event_type, "data": _jsonable(data)}
+        for subscriber in list(self._subscribers):
+            if user_id is not None and subscriber.user_id != user_id:
+                continue
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is subscriber.loop:
+                subscriber.offer(event)
+            else:
+                # Published from a worker thread (sync endpoint or background task)
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+
+
+def _jsonable(data: dict):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in data.items()}
+
+
+def format_sse(event: dict):
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def sse_stream(subscriber, initial_events=()):
+    try:
+        for event in initial_events:
+            yield format_sse(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def websocket_stream(websocket, subscriber, initial_events=()):
+    """Send events until the client goes away.
+
+    Clients do not send anything, so a concurrent receive() is what notices
+    a close frame, or the server's own ping timing out, while no events are
+    published.
+    """
+    async def send_events():
+        try:
+            for event in initial_events:
+                await websocket.send_json(event)
+            while True:
+                await websocket.send_json(await subscriber.queue.get())
+        except WebSocketDisconnect:
+            pass
+
+    async def wait_for_close():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    async def until_first_returns(task_group, func):
+        await func()
+        task_group.cancel_scope.cancel()
+
+    try:
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(until_first_returns, task_group, send_events)
+            task_group.start_soon(until_first_returns, task_group, wait_for_close)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+broadcaster = Broadcaster()
@@ -1,31 +1,118 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, Query
+import base64
+from contextlib import contextmanager
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, WebSocket, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import func, insert, select, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from typing import List, Optional
-from datetime import datetime, timedelta,timezone
-import joblib
+from datetime import date, datetime, timezone
 import auth
-from database import SessionLocal, engine
+from database import SessionLocal, engine, get_db, get_async_db, get_async_sessionmaker
 import models, schemas
+from alert_engine import threshold_index, alert_cooldowns, POLLUTANTS
+from ml_model import model_registry
+from anomaly import ANOMALY_DETECTION, DropoutSweeper, anomaly_detector
+import rollups
+import downsample
+import export
+import columnar_export
+import live
+import latest_cache
+import ingest_buffer
+import retention
+import forecasting
+import devices
+import migrations
+from ml_scoring import run_incremental_scoring, score_after_ingest
 from fastapi import BackgroundTasks
-from utils.email import send_alert_email
+from notifications import EMAIL_WORKER_ENABLED, email_worker, enqueue_alert_email
+import observability
 import logging
 from jinja2 import Environment, FileSystemLoader
 
-# Loglama yapılandırması
-logging.basicConfig(
-    level=logging.DEBUG, 
-    format='%(asctime)s - %(levelname)s - %(message)s', 
-    handlers=[logging.FileHandler("app.log"), logging.StreamHandler()]
-)
+# Loglama yapılandırması: kayıtlar kuyruktan ayrı bir thread ile yazılır
+observability.configure_logging()
 logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+migrations.run_migrations(engine)
 
 app = FastAPI()
 logger.info("Uygulama başlatıldı.")
+
+@app.on_event("startup")
+def load_threshold_index():
+    db = SessionLocal()
+    try:
+        threshold_index.rebuild(db)
+        alert_cooldowns.rebuild(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def backfill_rollups():
+    db = SessionLocal()
+    try:
+        rollups.backfill_if_empty(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def load_model():
+    try:
+        model_registry.get()
+    except Exception:
+        # /ml/process will retry the load lazily
+        logger.exception("Model could not be loaded at startup.")
+
+@app.on_event("startup")
+def start_email_worker():
+    if EMAIL_WORKER_ENABLED:
+        email_worker.start()
+
+@app.on_event("shutdown")
+def stop_email_worker():
+    email_worker.stop()
+
+@app.on_event("startup")
+def start_ingest_buffer():
+    if ingest_buffer.INGEST_WRITE_BEHIND:
+        write_behind.start()
+
+@app.on_event("shutdown")
+def flush_ingest_buffer():
+    write_behind.stop()
+
+@app.on_event("startup")
+def start_retention():
+    if retention.RETENTION_SCHEDULER:
+        retention.retention_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_retention():
+    retention.retention_scheduler.stop()
+
+@app.on_event("startup")
+def start_forecasts():
+    if forecasting.FORECAST_SCHEDULER:
+        forecasting.forecast_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_forecasts():
+    forecasting.forecast_scheduler.stop()
+
+@app.on_event("startup")
+def start_dropout_sweeper():
+    if ANOMALY_DETECTION:
+        dropout_sweeper.start()
+
+@app.on_event("shutdown")
+def stop_dropout_sweeper():
+    dropout_sweeper.stop()
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -34,137 +121,353 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(observability.MetricsMiddleware)
+
+api_prefix = "/api"
+HISTORY_LIMIT = 180
+
+# ENDPOINTS
 
-def get_db():
+def raise_threshold_alerts(db: Session, data, now_utc: datetime, claims: list = None):
+    threshold_index.ensure_fresh(db)
+    alert_cooldowns.observe(data)
+    crossed = threshold_index.evaluate(data)
+    raised = []
+
+    for user_id, pollutants in crossed.items():
+        user = threshold_index.user(user_id)
+        if not user:
+            continue
+
+        thresholds = user["thresholds"]
+        exceeded = []
+
+        for pollutant in pollutants:
+            current_value = getattr(data, pollutant)
+            threshold = thresholds.get(pollutant)
+
+            if not alert_cooldowns.claim(user_id, pollutant, threshold, now_utc, claims):
+                logger.info(f"Alarm for {pollutant} already sent recently for user {user['email']}. Skipping...")
+                continue  # aynı alarm zaten yakın zamanda gönderilmiş
+
+            exceeded.append({
+                "type": pollutant,
+                "value": current_value,
+                "threshold": threshold
+            })
+
+            alert = models.Alert(
+                user_id=user_id,
+                timestamp=now_utc,
+                type=pollutant,
+                value=current_value,
+                threshold=threshold,
+                acknowledged=False
+            )
+            db.add(alert)
+            raised.append(alert)
+
+        if exceeded:
+            
+
+            # Loglama: Uyarı gönderme öncesi log
+            logger.info(f"Sending alert email to {user['email']} with exceeded thresholds: {exceeded}")
+
+            # Queued in the same transaction as the alerts; the email worker sends it
+            enqueue_alert_email(
+                db,
+                user_id=user_id,
+                recipient=user["email"],
+                alert_info={
+                    "timestamp": now_utc.strftime("%Y-%m-%d %H:%M:%S"),
+                    "co2": getattr(data, "co2"),
+                    "pm25": getattr(data, "pm25"),
+                    "pm10": getattr(data, "pm10"),
+                    "voc": getattr(data, "voc"),
+                    "temperature": getattr(data, "temperature"),
+                    "humidity": getattr(data, "humidity"),
+                },
+                thresholds=thresholds
+            )
+
+    # Flushed so the live stream can carry alert ids without reloading them after commit
+    if raised:
+        db.flush()
+    return [schemas.Alert.model_validate(alert).model_dump() | {"user_id": alert.user_id} for alert in raised]
+
+
+def anomaly_recipients(db: Session, device_id: Optional[int]):
+    # The device owner, or every subscribed user for readings without a device
+    if device_id is not None:
+        device = db.get(models.Device, device_id)
+        if device is not None and device.owner_id is not None:
+            return [device.owner_id]
+    return threshold_index.user_ids()
+
+
+def raise_anomaly_alerts(db: Session, rows, now_utc: datetime, claims: list = None):
+    """Alerts for spikes, stuck values and dropouts; detection itself needs no query."""
+    if not ANOMALY_DETECTION:
+        return []
+    return raise_detection_alerts(db, anomaly_detector.observe_many(rows, now_utc), now_utc, claims)
+
+
+def raise_detection_alerts(db: Session, detections, now_utc: datetime, claims: list = None):
+    raised = []
+    for detection in detections:
+        logger.info(f"Anomaly on device {detection['device_id']}: {detection}")
+        for user_id in anomaly_recipients(db, detection["device_id"]):
+            if not alert_cooldowns.claim(user_id, detection["type"], detection["threshold"], now_utc, claims):
+                continue
+            alert = models.Alert(
+                user_id=user_id,
+                timestamp=now_utc,
+                type=detection["type"],
+                value=detection["value"],
+                threshold=detection["threshold"],
+                acknowledged=False
+            )
+            db.add(alert)
+            raised.append(alert)
+
+    if raised:
+        db.flush()
+    return [schemas.Alert.model_validate(alert).model_dump() | {"user_id": alert.user_id} for alert in raised]
+
+
+def publish_alerts(alerts):
+    for alert in alerts:
+        live.broadcaster.publish("alert", alert, user_id=alert["user_id"])
+
+
+def publish_live(reading: dict, alerts):
+    latest_cache.latest_reading.put(reading)
+    live.broadcaster.publish("reading", reading)
+    publish_alerts(alerts)
+
+
+def newest_reading(rows):
+    # A batch can mix offset and naive device timestamps
+    return max(rows, key=lambda row: rollups.naive(row["timestamp"]))
+
+
+def peak_reading(rows):
+    """Newest reading with each pollutant replaced by its maximum over `rows`."""
+    latest = newest_reading(rows)
+    return schemas.SensorData(**(latest | {
+        pollutant: max(row[pollutant] for row in rows)
+        for pollutant in POLLUTANTS
+    }))
+
+
+@contextmanager
+def alert_state_transaction(db: Session, rows):
+    """Commit the block's writes; if anything fails, roll back the cooldown claims
+    and detector updates made for `rows` too, so a retry raises the same alerts."""
+    claims = []
+    detector_state = anomaly_detector.snapshot(rows)
+    try:
+        yield claims
+        db.commit()
+    except Exception:
+        db.rollback()
+        alert_cooldowns.release(claims)
+        anomaly_detector.restore(detector_state)
+        raise
+
+
+def store_readings(db: Session, rows, now_utc: datetime):
+    """Insert readings, their rollups and any alerts in one transaction."""
+    alerts = []
+    with alert_state_transaction(db, rows) as claims:
+        # One executemany for the rows; thresholds are evaluated once per device, against its peak
+        db.execute(insert(models.ArduinoData), rows)
+        rollups.apply_readings(db, rows)
+        by_device = {}
+        for row in rows:
+            by_device.setdefault(row.get("device_id"), []).append(row)
+        for device_rows in by_device.values():
+            alerts += raise_threshold_alerts(db, peak_reading(device_rows), now_utc, claims)
+        alerts += raise_anomaly_alerts(db, rows, now_utc, claims)
+    return alerts
+
+
+def raise_dropout_alerts(detections):
+    """Sweeper callback for devices that stopped sending."""
     db = SessionLocal()
     try:
-        yield db
+        with alert_state_transaction(db, []) as claims:
+            alerts = raise_detection_alerts(db, detections, datetime.now(timezone.utc), claims)
     finally:
         db.close()
+    publish_alerts(alerts)
 
-api_prefix = "/api"
 
-# ENDPOINTS
+dropout_sweeper = DropoutSweeper(anomaly_detector, raise_dropout_alerts)
 
-from fastapi import BackgroundTasks
-from utils.email import send_alert_email  # doğru path ile import et
 
+def flush_buffered_readings(rows):
+    db = SessionLocal()
+    try:
+        alerts = store_readings(db, rows, datetime.now(timezone.utc))
+    finally:
+        db.close()
+    # Only committed readings reach the live stream and the latest cache
+    for row in rows:
+        publish_live(row, [])
+    publish_alerts(alerts)
+    score_after_ingest()
+
+
+write_behind = ingest_buffer.IngestBuffer(flush_buffered_readings)
+
+
+# Ingest writes several tables through the sync session, so it runs in the threadpool
 @app.post(f"{api_prefix}/sensors/data")
-async def receive_data(
+def receive_data(
     data: schemas.SensorData,
     background_tasks: BackgroundTasks,
+    device_id: Optional[int] = Depends(devices.get_ingest_device_id),
     db: Session = Depends(get_db)
 ):
     now_utc = datetime.now(timezone.utc)
 
     payload = data.model_dump()
     payload["timestamp"] = now_utc  # timestamp override
-    new_data = models.ArduinoData(**payload)
-    db.add(new_data)
-    db.commit()
-
-    users = db.query(models.User).all()
-
-    for user in users:
-        settings = db.query(models.UserSettings).filter_by(user_id=user.id).first()
-        if not settings or not settings.notifications:
-            continue
-
-        thresholds = settings.thresholds
-        exceeded = []
-
-        for pollutant in ["co2", "pm25", "pm10", "voc"]:
-            current_value = getattr(data, pollutant)
-            threshold = thresholds.get(pollutant)
+    payload["device_id"] = device_id
+
+    if ingest_buffer.INGEST_WRITE_BEHIND:
+        # Acknowledged once buffered; the flusher group-commits, raises alerts and publishes
+        try:
+            write_behind.put(payload)
+        except ingest_buffer.BufferFull:
+            raise HTTPException(status_code=503, detail="Ingest buffer full, retry later",
+                                headers={"Retry-After": "1"})
+        return {
+            "success": True,
+            "buffered": True,
+            "timestamp": now_utc.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    with alert_state_transaction(db, [payload]) as claims:
+        new_data = models.ArduinoData(**payload)
+        db.add(new_data)
+        rollups.apply_readings(db, [payload])
+        alerts = raise_threshold_alerts(db, data, now_utc, claims)
+        alerts += raise_anomaly_alerts(db, [payload], now_utc, claims)
+    publish_live(payload, alerts)
+    background_tasks.add_task(score_after_ingest)
+    return {
+        "success": True,
+        "timestamp": now_utc.strftime("%Y-%m-%d %H:%M:%S")
+    }
 
-            if current_value and threshold and current_value > threshold:
-                recent_alert = db.query(models.Alert).filter_by(
-                    user_id=user.id,
-                    type=pollutant,
-                    value=current_value
-                ).order_by(models.Alert.timestamp.desc()).first()
-
-                if recent_alert:
-                    alert_time = recent_alert.timestamp
-                    if alert_time.tzinfo is None:
-                        alert_time = alert_time.replace(tzinfo=timezone.utc)
-
-                    if alert_time > now_utc - timedelta(minutes=5):
-                        logger.info(f"Alarm for {pollutant} already sent recently for user {user.email}. Skipping...")
-                        continue  # aynı alarm zaten yakın zamanda gönderilmiş
-
-                exceeded.append({
-                    "type": pollutant,
-                    "value": current_value,
-                    "threshold": threshold
-                })
-
-                alert = models.Alert(
-                    user_id=user.id,
-                    timestamp=now_utc,
-                    type=pollutant,
-                    value=current_value,
-                    threshold=threshold,
-                    acknowledged=False
-                )
-                db.add(alert)
 
-        if exceeded:
-            
+MAX_BATCH_SIZE = 5000
 
-            # Loglama: Uyarı gönderme öncesi log
-            logger.info(f"Sending alert email to {user.email} with exceeded thresholds: {exceeded}")
-
-            # Burada 'user_email' kullanmalıyız
-            background_tasks.add_task(
-            send_alert_email,
-            user_email=user.email,
-            alert_info={
-                "timestamp": now_utc.strftime("%Y-%m-%d %H:%M:%S"),
-                "co2": getattr(data, "co2"),
-                "pm25": getattr(data, "pm25"),
-                "pm10": getattr(data, "pm10"),
-                "voc": getattr(data, "voc"),
-                "temperature": getattr(data, "temperature"),
-                "humidity": getattr(data, "humidity"),
-            },
-            thresholds=thresholds
-        )
+@app.post(f"{api_prefix}/sensors/data/batch")
+def receive_data_batch(
+    data: List[schemas.SensorData],
+    background_tasks: BackgroundTasks,
+    device_id: Optional[int] = Depends(devices.get_ingest_device_id),
+    db: Session = Depends(get_db)
+):
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    if len(data) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE} readings)")
 
-        
+    now_utc = datetime.now(timezone.utc)
 
-    db.commit()
+    # Buffered readings keep the device timestamp
+    rows = [reading.model_dump() | {"device_id": device_id} for reading in data]
+    alerts = store_readings(db, rows, now_utc)
+    publish_live(newest_reading(rows), alerts)
+    background_tasks.add_task(score_after_ingest)
     return {
         "success": True,
+        "inserted": len(rows),
         "timestamp": now_utc.strftime("%Y-%m-%d %H:%M:%S")
     }
 
 
 
-@app.get(f"{api_prefix}/sensors/history", response_model=List[schemas.SensorData])
+def downsampled_series(db: Session, start, end, metrics, max_points, resolution, mode, lttb_metric, device_id=None):
+    if mode not in downsample.MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode, expected one of {', '.join(downsample.MODES)}")
+    if mode == "lttb" and lttb_metric not in metrics:
+        raise HTTPException(status_code=400, detail="Invalid lttb_metric")
+    try:
+        width = downsample.parse_resolution(resolution) if resolution else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not (start and end):
+        start, end = downsample.data_range(db, device_id)
+        if start is None:
+            return []
+    return downsample.downsample(db, start, end, metrics, max_points, width, mode, lttb_metric, device_id)
+
+
+@app.get(
+    f"{api_prefix}/sensors/history",
+    response_model=List[schemas.SensorBucket],
+    response_model_exclude_none=True
+)
 async def get_data(
     start: Optional[datetime] = Query(None),
     end: Optional[datetime] = Query(None),
-    db: Session = Depends(get_db)
+    max_points: Optional[int] = Query(None, ge=2, le=downsample.MAX_POINTS_LIMIT),
+    resolution: Optional[str] = Query(None),
+    mode: str = Query("avg"),
+    lttb_metric: str = Query("pm25"),
+    device_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(models.ArduinoData).order_by(models.ArduinoData.timestamp.desc())
+    # Bucketed on the server when max_points/resolution is given, or when
+    # the range reaches back past the raw retention horizon
+    if max_points or resolution:
+        return await db.run_sync(
+            downsampled_series, start, end, rollups.METRICS, max_points, resolution, mode, lttb_metric, device_id
+        )
+    if end and rollups.compacted(start):
+        return await db.run_sync(
+            downsampled_series, start, end, rollups.METRICS, HISTORY_LIMIT, None, mode, lttb_metric, device_id
+        )
+
+    query = select(models.ArduinoData).order_by(models.ArduinoData.timestamp.desc())
 
     if start and end:
-        query = query.filter(models.ArduinoData.timestamp.between(start, end))
+        query = query.where(models.ArduinoData.timestamp.between(start, end))
+    if device_id is not None:
+        query = query.where(rollups.device_filter(models.ArduinoData, device_id))
 
-    query = query.limit(180)
-    records = query.all()
+    query = query.limit(HISTORY_LIMIT)
+    records = (await db.execute(query)).scalars().all()
     return records
 
 
 
 
-@app.get(f"{api_prefix}/sensors/summary", response_model=List[schemas.PartialSensorData])
+@app.get(
+    f"{api_prefix}/sensors/summary",
+    response_model=List[schemas.PartialSensorBucket],
+    response_model_exclude_none=True
+)
 def get_sensor_summary(
     start_time: Optional[datetime] = Query(None),
     end_time: Optional[datetime] = Query(None),
+    max_points: Optional[int] = Query(None, ge=2, le=downsample.MAX_POINTS_LIMIT),
+    resolution: Optional[str] = Query(None),
+    mode: str = Query("avg"),
+    lttb_metric: str = Query("pm25"),
+    device_id: Optional[int] = Query(None),
     db: Session = Depends(get_db)
 ):
+    if max_points or resolution or (end_time and rollups.compacted(start_time)):
+        metrics = ["temperature", "humidity", "pm25", "pm10"]
+        return downsampled_series(db, start_time, end_time, metrics, max_points, resolution, mode, lttb_metric, device_id)
+
     query = db.query(
         models.ArduinoData.timestamp,
         models.ArduinoData.temperature,
@@ -176,44 +479,263 @@ def get_sensor_summary(
 
     if start_time and end_time:
         query = query.filter(models.ArduinoData.timestamp.between(start_time, end_time))
+    if device_id is not None:
+        query = query.filter(rollups.device_filter(models.ArduinoData, device_id))
 
     data = query.order_by(models.ArduinoData.timestamp.desc())
     return data
 
+@app.get(f"{api_prefix}/sensors/export")
+def export_sensor_data(
+    start_time: Optional[datetime] = Query(None),
+    end_time: Optional[datetime] = Query(None),
+    export_format: str = Query("ndjson", alias="format"),
+    chunk_size: int = Query(export.EXPORT_CHUNK_SIZE, ge=100, le=50000),
+    device_id: Optional[int] = Query(None)
+):
+    if export_format not in export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format, expected one of {', '.join(export.EXPORT_FORMATS)}")
+
+    # Pages are read lazily while the response streams, on their own session
+    pages = export.iter_reading_pages(start_time, end_time, chunk_size, device_id)
+    if export_format == "csv":
+        return StreamingResponse(
+            export.csv_chunks(pages),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="arduino_data.csv"'}
+        )
+    return StreamingResponse(export.ndjson_chunks(pages), media_type="application/x-ndjson")
+
+def _columnar_table(table: str):
+    if table not in columnar_export.EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="Unknown export table")
+    if not columnar_export.available():
+        raise HTTPException(status_code=501, detail="Columnar export requires pyarrow")
+
+@app.post(f"{api_prefix}/export/{{table}}")
+def run_columnar_export(
+    table: str,
+    export_format: str = Query("parquet", alias="format"),
+    full: bool = Query(False)
+):
+    _columnar_table(table)
+    if export_format not in columnar_export.COLUMNAR_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format, expected parquet or arrow")
+
+    # Reads go through their own session; only changed day partitions are rewritten
+    db = SessionLocal()
+    try:
+        exported = columnar_export.export_table(db, table, export_format, full)
+    finally:
+        db.close()
+    return {"table": table, "format": export_format, "exported": exported}
+
+@app.get(f"{api_prefix}/export/{{table}}")
+def list_columnar_partitions(table: str):
+    _columnar_table(table)
+    return {"table": table, "partitions": columnar_export.load_manifest(table)}
+
+@app.get(f"{api_prefix}/export/{{table}}/{{day}}")
+def download_columnar_partition(table: str, day: date):
+    _columnar_table(table)
+    entry = columnar_export.load_manifest(table).get(day.isoformat())
+    if not entry:
+        raise HTTPException(status_code=404, detail="Partition not exported")
+
+    path = columnar_export.partition_path(table, day.isoformat(), entry["format"])
+    media_type = "application/vnd.apache.parquet" if entry["format"] == "parquet" else "application/vnd.apache.arrow.file"
+    return FileResponse(path, media_type=media_type, filename=entry["file"])
+
+def _latest_reading_event(db: Session):
+    entry = latest_cache.latest_reading.get(db)
+    if not entry:
+        return []
+    return [{"event": "reading", "data": live._jsonable(entry.data)}]
+
+def _stream_user_id(db: Session, token: Optional[str]):
+    # EventSource/WebSocket clients cannot set headers, so the token comes as a query param
+    if not token:
+        return None
+    user = auth.get_user_from_token(db, token)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    return user.id
+
+@app.get(f"{api_prefix}/sensors/stream")
+async def stream_live_data(token: Optional[str] = Query(None), db: AsyncSession = Depends(get_async_db)):
+    # One query per connection for the initial state, then pushed events only
+    user_id = await db.run_sync(_stream_user_id, token)
+    initial = await db.run_sync(_latest_reading_event)
+    subscriber = live.broadcaster.subscribe(user_id)
+    return StreamingResponse(
+        live.sse_stream(subscriber, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket(f"{api_prefix}/sensors/ws")
+async def live_data_websocket(websocket: WebSocket, token: Optional[str] = Query(None)):
+    async with get_async_sessionmaker()() as db:
+        try:
+            user_id = await db.run_sync(_stream_user_id, token)
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        initial = await db.run_sync(_latest_reading_event)
+
+    await websocket.accept()
+    subscriber = live.broadcaster.subscribe(user_id)
+    await live.websocket_stream(websocket, subscriber, initial)
+
+def cached_response(request: Request, entry):
+    # Unchanged polls get a bodyless 304 straight from memory
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == entry.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
 @app.get(f"{api_prefix}/sensors/current", response_model=schemas.SensorData)
-async def get_current_data(db: Session = Depends(get_db)):
-    record = db.query(models.ArduinoData).order_by(models.ArduinoData.timestamp.desc()).first()
-    if not record:
+async def get_current_data(
+    request: Request,
+    device_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # The session only opens a connection on a cold or expired entry
+    entry = (latest_cache.latest_reading.fresh(device_id)
+             or await db.run_sync(latest_cache.latest_reading.get, device_id))
+    if not entry:
         raise HTTPException(status_code=404, detail="No sensor data found")
-    return record
+    return cached_response(request, entry)
 
 @app.get(f"{api_prefix}/stats")
-async def get_stats(metric: str, start: datetime, end: datetime, db: Session = Depends(get_db)):
-    if metric not in ["temperature", "humidity", "pm25", "pm10", "co2", "voc"]:
+async def get_stats(
+    metric: str,
+    start: datetime,
+    end: datetime,
+    device_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if metric not in rollups.METRICS:
         raise HTTPException(status_code=400, detail="Invalid metric")
-    
-    from sqlalchemy import func
 
-    result = db.query(
-        func.min(getattr(models.ArduinoData, metric)),
-        func.max(getattr(models.ArduinoData, metric)),
-        func.avg(getattr(models.ArduinoData, metric)),
-        func.stddev_pop(getattr(models.ArduinoData, metric))
-    ).filter(models.ArduinoData.timestamp.between(start, end)).one()
+    # Full buckets come from the rollup tables, only the partial edges scan arduino_data
+    result = (await db.run_sync(rollups.range_stats, start, end, [metric], device_id))[metric]
 
     return {
         "metric": metric,
-        "min": result[0],
-        "max": result[1],
-        "avg": result[2],
-        "stddev": result[3]
+        "min": result["min"],
+        "max": result["max"],
+        "avg": result["avg"],
+        "stddev": result["stddev"]
+    }
+
+@app.get(f"{api_prefix}/stats/multi")
+async def get_multi_stats(
+    start: datetime,
+    end: datetime,
+    metrics: List[str] = Query(rollups.METRICS),
+    percentiles: bool = Query(False),
+    device_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # ?metrics=pm25,co2 and ?metrics=pm25&metrics=co2 are both accepted
+    requested = [m.strip() for value in metrics for m in value.split(",") if m.strip()]
+    invalid = [m for m in requested if m not in rollups.METRICS]
+    if not requested or invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid metric(s): {', '.join(invalid) or 'none given'}")
+    requested = list(dict.fromkeys(requested))
+
+    stats = await db.run_sync(rollups.range_stats, start, end, requested, device_id)
+    response = {
+        "start": start,
+        "end": end,
+        "metrics": stats
     }
+    if percentiles:
+        exact = await db.run_sync(
+            lambda session: rollups.range_percentiles(session, start, end, requested, device_id=device_id)
+        )
+        for metric, values in exact.items():
+            stats[metric].update(values)
+        # Percentiles come from raw rows, so they may cover only the newest part of the range
+        lower, upper = rollups.percentile_window(start, end)
+        response["percentile_range"] = {
+            "start": lower,
+            "end": upper,
+            "partial": lower > rollups.naive(start),
+        }
+    return response
+
+# Cihaz kaydı: her Arduino kendi API anahtarıyla (X-Device-Key) veri gönderir
+def _owned_device(db: Session, device_id: int, user: auth.Principal):
+    device = db.query(models.Device).filter(
+        models.Device.id == device_id,
+        models.Device.owner_id == user.id
+    ).first()
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return device
+
+def _device_with_key(device: models.Device, api_key: str):
+    return schemas.DeviceOut.model_validate(device).model_dump() | {"api_key": api_key}
+
+@app.post(f"{api_prefix}/devices", response_model=schemas.DeviceWithKey)
+def register_device(
+    device: schemas.DeviceCreate,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    api_key = devices.generate_api_key()
+    db_device = models.Device(
+        name=device.name,
+        owner_id=current_user.id,
+        api_key_hash=devices.hash_api_key(api_key),
+        is_active=True
+    )
+    db.add(db_device)
+    db.commit()
+    db.refresh(db_device)
+    return _device_with_key(db_device, api_key)
+
+@app.get(f"{api_prefix}/devices", response_model=List[schemas.DeviceOut])
+def list_devices(
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    return db.query(models.Device).filter(models.Device.owner_id == current_user.id).order_by(models.Device.id).all()
+
+@app.post(f"{api_prefix}/devices/{{device_id}}/rotate-key", response_model=schemas.DeviceWithKey)
+def rotate_device_key(
+    device_id: int,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    device = _owned_device(db, device_id, current_user)
+    api_key = devices.generate_api_key()
+    device.api_key_hash = devices.hash_api_key(api_key)
+    db.commit()
+    db.refresh(device)
+    devices.device_keys.invalidate()
+    return _device_with_key(device, api_key)
+
+@app.post(f"{api_prefix}/devices/{{device_id}}/deactivate", response_model=schemas.DeviceOut)
+def deactivate_device(
+    device_id: int,
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    device = _owned_device(db, device_id, current_user)
+    device.is_active = False
+    db.commit()
+    db.refresh(device)
+    devices.device_keys.invalidate()
+    return device
 
 # GET: Kullanıcının kendi ayarlarını getir
 @app.get(f"{api_prefix}/settings", response_model=schemas.UserSettings)
 def get_user_settings(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
     settings = db.query(models.UserSettings).filter(models.UserSettings.user_id == current_user.id).first()
     if not settings:
@@ -227,6 +749,7 @@ def get_user_settings(
         db.add(settings)
         db.commit()
         db.refresh(settings)
+        threshold_index.upsert_user(current_user.id, current_user.email, settings.notifications, settings.thresholds)
     return settings
 
 
@@ -236,7 +759,7 @@ def get_user_settings(
 def update_user_settings(
     updated_settings: schemas.UserSettingsCreate,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
     settings = db.query(models.UserSettings).filter(models.UserSettings.user_id == current_user.id).first()
     if not settings:
@@ -247,26 +770,87 @@ def update_user_settings(
             setattr(settings, key, value)
     db.commit()
     db.refresh(settings)
+    threshold_index.upsert_user(current_user.id, current_user.email, settings.notifications, settings.thresholds)
+    alert_cooldowns.reset_user(current_user.id)
+    auth.principal_cache.invalidate(current_user.email)
     return settings
 
 
 
+ALERT_PAGE_SIZE = 100
+ALERT_PAGE_MAX = 1000
+
+def _encode_alert_cursor(alert: models.Alert):
+    raw = f"{rollups.naive(alert.timestamp).isoformat()}|{alert.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_alert_cursor(cursor: str):
+    try:
+        timestamp, alert_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(alert_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _alert_filters(user_id: int, acknowledged=None, alert_type=None, start=None, end=None):
+    filters = [models.Alert.user_id == user_id]
+    if acknowledged is not None:
+        filters.append(models.Alert.acknowledged == acknowledged)
+    if alert_type:
+        filters.append(models.Alert.type == alert_type)
+    if start:
+        filters.append(models.Alert.timestamp >= start)
+    if end:
+        filters.append(models.Alert.timestamp <= end)
+    return filters
+
+def _alert_page(db: Session, filters, limit: int, cursor: Optional[str] = None):
+    # Keyset on (timestamp, id) newest first; served by the user/ack and user/type indexes
+    query = db.query(models.Alert).filter(*filters)
+    if cursor:
+        cursor_ts, cursor_id = _decode_alert_cursor(cursor)
+        query = query.filter(or_(
+            models.Alert.timestamp < cursor_ts,
+            and_(models.Alert.timestamp == cursor_ts, models.Alert.id < cursor_id)
+        ))
+    # One extra row tells whether another page exists
+    rows = query.order_by(models.Alert.timestamp.desc(), models.Alert.id.desc()).limit(limit + 1).all()
+    next_cursor = _encode_alert_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@app.get("/api/alerts", response_model=schemas.AlertPage)
+def list_alerts(
+    acknowledged: Optional[bool] = Query(None),
+    alert_type: Optional[str] = Query(None, alias="type"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    limit: int = Query(ALERT_PAGE_SIZE, ge=1, le=ALERT_PAGE_MAX),
+    cursor: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user)
+):
+    filters = _alert_filters(current_user.id, acknowledged, alert_type, start, end)
+    items, next_cursor = _alert_page(db, filters, limit, cursor)
+    return {"items": items, "next_cursor": next_cursor}
+
 @app.get("/api/alerts/unacknowledged", response_model=List[schemas.Alert])
 def get_user_unacknowledged_alerts(
+    alert_type: Optional[str] = Query(None, alias="type"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    limit: int = Query(ALERT_PAGE_MAX, ge=1, le=ALERT_PAGE_MAX),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    alerts = db.query(models.Alert).filter(
-        models.Alert.user_id == current_user.id,
-        models.Alert.acknowledged == False  # veya == 0 eğer boolean değilse
-    ).order_by(models.Alert.timestamp.desc()).all()
+    # Newest first and capped; /api/alerts?acknowledged=false pages through the rest
+    filters = _alert_filters(current_user.id, False, alert_type, start, end)
+    alerts, _ = _alert_page(db, filters, limit)
     return alerts
 
 @app.post("/api/alerts/acknowledge", response_model=schemas.Alert)
 def acknowledge_alert(
     request: schemas.AlertAcknowledgeRequest,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
     alert = db.query(models.Alert).filter(
         models.Alert.id == request.alert_id,
@@ -288,27 +872,24 @@ def acknowledge_alert(
 #TÜM ALERTLERİ ACKNOWLEDGE ET
 @app.post("/api/alerts/acknowledgeall")
 def acknowledge_all_alerts(
+    alert_type: Optional[str] = Query(None, alias="type"),
+    before: Optional[datetime] = Query(None),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: auth.Principal = Depends(auth.get_current_user)
 ):
-    # Kullanıcının acknowledged=False olan tüm uyarılarını al
-    unacknowledged_alerts = db.query(models.Alert).filter(
-        models.Alert.user_id == current_user.id,
-        models.Alert.acknowledged == False
-    ).all()
-
-    if not unacknowledged_alerts:
-        return {"message": "Tüm uyarılar zaten acknowledge edilmiş."}
-
-    # Tüm uyarıları acknowledge olarak işaretle
-    for alert in unacknowledged_alerts:
-        alert.acknowledged = True
-
+    # Tek bir UPDATE ... WHERE; satırlar belleğe yüklenmez
+    filters = _alert_filters(current_user.id, False, alert_type, end=before)
+    acknowledged = db.query(models.Alert).filter(*filters).update(
+        {models.Alert.acknowledged: True}, synchronize_session=False
+    )
     db.commit()
 
+    if not acknowledged:
+        return {"message": "Tüm uyarılar zaten acknowledge edilmiş.", "acknowledged": 0}
+
     return {
-        "message": f"{len(unacknowledged_alerts)} uyarı acknowledge edildi.",
-        "acknowledged_ids": [alert.id for alert in unacknowledged_alerts]
+        "message": f"{acknowledged} uyarı acknowledge edildi.",
+        "acknowledged": acknowledged
     }
 
 
@@ -335,6 +916,9 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db.add(default_settings)
     db.commit()
     db.refresh(default_settings)
+    threshold_index.upsert_user(db_user.id, db_user.email, default_settings.notifications, default_settings.thresholds)
+    # Drops anything cached for an earlier account with this email
+    auth.principal_cache.invalidate(db_user.email)
     return db_user
 
 @app.post("/auth/login", response_model=schemas.Token)
@@ -343,88 +927,101 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
 
-    access_token = auth.create_access_token(data={"sub": user.email})
+    access_token = auth.create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/auth/me", response_model=schemas.UserOut)
-def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
+def read_users_me(current_user: auth.Principal = Depends(auth.get_current_user)):
     return current_user
 
 #AI END POINTS    
 @app.get(f"{api_prefix}/ai/latest", response_model=schemas.AIOutput)
-def get_latest_prediction(db: Session = Depends(get_db)):
-    latest_prediction = db.query(models.AIOutput).order_by(models.AIOutput.timestamp.desc()).first()
-    if not latest_prediction:
+async def get_latest_prediction(
+    request: Request,
+    device_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    entry = (latest_cache.latest_prediction.fresh(device_id)
+             or await db.run_sync(latest_cache.latest_prediction.get, device_id))
+    if not entry:
         raise HTTPException(status_code=404, detail="No predictions found")
-    return latest_prediction
+    return cached_response(request, entry)
+
+@app.get(f"{api_prefix}/ai/forecast", response_model=schemas.Forecast)
+async def get_forecast(
+    request: Request,
+    device_id: Optional[int] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Precomputed by the forecast scheduler; this only reads the newest issue
+    entry = (forecasting.latest_forecast.fresh(device_id)
+             or await db.run_sync(forecasting.latest_forecast.get, device_id))
+    if not entry:
+        raise HTTPException(status_code=404, detail="No forecasts found")
+    return cached_response(request, entry)
+
+@app.get(f"{api_prefix}/anomalies/baseline")
+def get_anomaly_baseline(device_id: Optional[int] = Query(None)):
+    # Rolling mean/deviation the spike detector compares readings against
+    return {"device_id": device_id, "metrics": anomaly_detector.baseline(device_id)}
+
+@app.get("/ml/model")
+def get_model_status():
+    return model_registry.stats()
+
+EMAIL_OUTBOX_GAUGE_STATUSES = ("pending", "failed")
+
+def _email_outbox_depth():
+    # Sent rows are the bulk of the table; these statuses are a range of ix_email_outbox_status_due
+    db = SessionLocal()
+    try:
+        rows = db.query(models.EmailOutbox.status, func.count()).filter(
+            models.EmailOutbox.status.in_(EMAIL_OUTBOX_GAUGE_STATUSES)
+        ).group_by(models.EmailOutbox.status).all()
+    finally:
+        db.close()
+    counts = dict.fromkeys(EMAIL_OUTBOX_GAUGE_STATUSES, 0) | dict(rows)
+    return {(state,): count for state, count in counts.items()}
+
+observability.registry.register(observability.Gauge(
+    "email_outbox_messages", "Pending and failed alert e-mails in the outbox", _email_outbox_depth, ("status",)))
+observability.registry.register(observability.Gauge(
+    "ingest_buffer_depth", "Readings waiting in the write-behind buffer", lambda: {(): write_behind.depth}))
+observability.registry.register(observability.Gauge(
+    "live_subscribers", "Open SSE and websocket subscribers", lambda: {(): live.broadcaster.subscriber_count}))
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(observability.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/ml/forecast")
+def issue_forecasts(db: Session = Depends(get_db)):
+    # Same run the scheduler does, for deployments that trigger it externally
+    result = forecasting.run_forecasts(db)
+    if result is None:
+        raise HTTPException(status_code=409, detail="No forecast model trained yet")
+    return result
 
 @app.post("/ml/process")
 def process_and_store_ai_output(
     start_time: Optional[datetime] = Query(None),
     end_time: Optional[datetime] = Query(None),
+    device_id: Optional[int] = Query(None),
     db: Session = Depends(get_db)
 ):
-    query = db.query(
-        models.ArduinoData.timestamp,
-        models.ArduinoData.temperature,
-        models.ArduinoData.humidity,
-        models.ArduinoData.pm25,
-        models.ArduinoData.pm10
-    )
+    """Score readings that have no prediction yet.
 
-    if start_time and end_time:
-        query = query.filter(models.ArduinoData.timestamp.between(start_time, end_time))
-
-    sensor_data = query.all()
-
-    for row in sensor_data:
-
-        time = row.timestamp
-        month = str(time).split('-')[1]
-        season_index = get_season(month)
-
-        data_for_prediction = [
-            row.temperature, 
-            row.humidity, 
-            row.pm25, 
-            row.pm10, 
-            season_index  # Add the season index as an additional feature for the model
-        ]
-        label = predict(data_for_prediction)
-
-        ai_output = models.AIOutput(
-            timestamp=row.timestamp,
-            temperature=row.temperature,
-            humidity=row.humidity,
-            pm25=row.pm25,
-            pm10=row.pm10,
-            prediction=label
-        )
-
-        db.add(ai_output)
-
-    db.commit()
-    return {"message": "AI outputs processed and stored."}
-
-
-def get_season(month):
-    if month in [12, 1, 2]:
-        return 3
-    elif month in [3, 4, 5]:
-        return 2
-    elif month in [6, 7, 8]:
-        return 1
-    else:
-        return 0
+    A start_time/end_time window and a device_id narrow the readings scored;
+    either way a reading is only ever scored once.
+    """
+    if (start_time is None) != (end_time is None):
+        raise HTTPException(status_code=400, detail="start_time and end_time must be given together")
 
-def predict(data):
-    categories = ["GOOD", "Moderate", "Unhealthy for Sensitive Groups", 
-                  "Unhealthy", "Very Unhealthy", "Hazardous"]
+    result = run_incremental_scoring(db, start_time, end_time, device_id)
+    if result is None:
+        raise HTTPException(status_code=409, detail="A scoring run is already in progress")
+    return {"message": "AI outputs processed and stored.", **result}
 
-# ("rf_model.pkl") ("backend//rf_model.pkl")
-    model = joblib.load("rf_model.pkl")
-    output = model.predict([data])    
-    return categories[int(output[0])]
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,252 @@
+from datetime import date, datetime
+import argparse
+import logging
+import re
+import time
+
+from sqlalchemy import text, delete, select, func, inspect
+
+import models
+import rollups
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLE = "arduino_data"
+_PARTITION_NAME = re.compile(r"^p(\d{4})(\d{2})$")
+
+
+def _create_named_indexes(conn, *names):
+    # create_all only adds indexes together with new tables; existing ones get them here.
+    # Each migration names its own, since later ones may index columns it predates.
+    declared = {index.name: index for table in models.Base.metadata.tables.values() for index in table.indexes}
+    for name in names:
+        declared[name].create(bind=conn, checkfirst=True)
+
+
+def _create_indexes(conn):
+    _create_named_indexes(
+        conn,
+        "ix_arduino_data_timestamp",
+        "ix_alerts_user_type_timestamp",
+        "ix_alerts_user_ack_timestamp",
+        "ix_aiOutput_timestamp",
+    )
+
+
+def _add_device_dimension(conn):
+    inspector = inspect(conn)
+    quote = conn.dialect.identifier_preparer.format_table
+    for table in (models.ArduinoData.__table__, models.AIOutput.__table__):
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        if "device_id" not in columns:
+            # Plain nullable column; existing rows belong to no device
+            conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN device_id INTEGER NULL"))
+    _create_named_indexes(conn, "ix_arduino_data_device_timestamp", "ix_aiOutput_device_timestamp")
+
+    # Rollups are keyed by (device_id, bucket) now. They are derived data, so the
+    # old tables are recreated empty and refilled by backfill_if_empty at startup.
+    for rollup, _, _ in rollups.RESOLUTIONS:
+        columns = {column["name"] for column in inspector.get_columns(rollup.__tablename__)}
+        if "device_id" not in columns:
+            rollup.__table__.drop(bind=conn)
+            rollup.__table__.create(bind=conn)
+
+
+def _link_predictions(conn):
+    inspector = inspect(conn)
+    quote = conn.dialect.identifier_preparer.format_table
+    added = {
+        models.AIOutput.__table__: {"data_id": "INTEGER NULL"},
+        models.MLWatermark.__table__: {"pending_data_id": "INTEGER NULL", "pending_since": "DATETIME NULL"},
+    }
+    for table, definitions in added.items():
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column, definition in definitions.items():
+            if column not in columns:
+                # Existing predictions stay unlinked; they are all below the scoring watermark
+                conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {column} {definition}"))
+    _create_named_indexes(conn, "ix_aiOutput_data_id")
+
+
+# Ordered, append-only: (version, name, upgrade function taking a connection)
+MIGRATIONS = [
+    (1, "time and alert lookup indexes", _create_indexes),
+    (2, "device_id on readings, predictions and rollups", _add_device_dimension),
+    (3, "aiOutput.data_id and settling scoring watermark", _link_predictions),
+]
+
+
+def run_migrations(engine):
+    """Create missing tables, then apply pending migrations in order."""
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        applied = set(conn.execute(select(models.SchemaMigration.version)).scalars())
+
+    for version, name, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            upgrade(conn)
+            conn.execute(models.SchemaMigration.__table__.insert().values(version=version, name=name))
+        logger.info(f"Applied migration {version}: {name}")
+
+
+# Monthly range partitioning of arduino_data (MySQL)
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+def _next_month(value):
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+def _partition_name(month):
+    return f"p{month:%Y%m}"
+
+def _partition_clause(month):
+    return f"PARTITION {_partition_name(month)} VALUES LESS THAN (TO_DAYS('{_next_month(month).isoformat()}'))"
+
+
+def list_partitions(engine):
+    """Month partitions of arduino_data as {name: month start}; empty when not partitioned."""
+    if engine.dialect.name != "mysql":
+        return {}
+    with engine.connect() as conn:
+        names = conn.execute(text(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL"
+        ), {"table": PARTITIONED_TABLE}).scalars().all()
+    partitions = {}
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def enable_monthly_partitioning(engine, months_ahead: int = 3):
+    """Rebuild arduino_data as RANGE(TO_DAYS(timestamp)) partitions, one per month.
+
+    MySQL requires the partition column in every unique key, so the primary
+    key becomes (data_id, timestamp). This copies the table once; run it
+    in a maintenance window.
+    """
+    if engine.dialect.name != "mysql":
+        raise RuntimeError("Monthly partitioning is only implemented for MySQL")
+    if list_partitions(engine):
+        return False
+
+    with engine.connect() as conn:
+        oldest = conn.execute(select(func.min(models.ArduinoData.timestamp))).scalar()
+    month = _month_start(oldest or datetime.utcnow())
+    last = _month_start(datetime.utcnow())
+    for _ in range(months_ahead):
+        last = _next_month(last)
+
+    clauses = []
+    while month <= last:
+        clauses.append(_partition_clause(month))
+        month = _next_month(month)
+    clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (data_id, timestamp)"))
+        conn.execute(text(
+            f"ALTER TABLE {PARTITIONED_TABLE} PARTITION BY RANGE (TO_DAYS(timestamp)) ({', '.join(clauses)})"
+        ))
+    logger.info(f"{PARTITIONED_TABLE} partitioned into {len(clauses)} partitions.")
+    return True
+
+
+def ensure_future_partitions(engine, months_ahead: int = 3):
+    """Split pmax so the next `months_ahead` months have their own partitions."""
+    partitions = list_partitions(engine)
+    if not partitions:
+        return []
+
+    month = _next_month(max(partitions.values()))
+    target = _month_start(datetime.utcnow())
+    for _ in range(months_ahead):
+        target = _next_month(target)
+
+    added = []
+    while month <= target:
+        added.append(month)
+        month = _next_month(month)
+    if added:
+        clauses = [_partition_clause(m) for m in added] + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} REORGANIZE PARTITION pmax INTO ({', '.join(clauses)})"))
+    return [_partition_name(m) for m in added]
+
+
+def drop_partitions_before(engine, cutoff: date):
+    """Drop month partitions of arduino_data that end on or before `cutoff`."""
+    partitions = list_partitions(engine)
+    expired = sorted(name for name, month in partitions.items() if _next_month(month) <= cutoff)
+    if expired:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} DROP PARTITION {', '.join(expired)}"))
+    return expired
+
+
+def delete_rows_before(engine, model, key, column, cutoff, chunk_size: int = 10000, pause: float = 0.0):
+    """Delete rows with `column` < `cutoff` in `key` chunks, one short transaction each."""
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(key).where(column < cutoff).order_by(key).limit(chunk_size)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(delete(model).where(key.in_(ids)))
+        deleted += len(ids)
+        if pause:
+            # Lets ingest transactions in between on a busy table
+            time.sleep(pause)
+    return deleted
+
+
+def drop_expired_data(engine, keep_months: int, chunk_size: int = 10000):
+    """Remove arduino_data older than `keep_months` whole months.
+
+    Partitioned tables lose whole partitions (a metadata operation);
+    otherwise rows are deleted in primary-key chunks so each transaction
+    and its locks stay short. Rollup tables are not touched.
+    """
+    cutoff = _month_start(datetime.utcnow())
+    for _ in range(keep_months):
+        cutoff = date(cutoff.year - (cutoff.month == 1), (cutoff.month - 2) % 12 + 1, 1)
+
+    if list_partitions(engine):
+        expired = drop_partitions_before(engine, cutoff)
+        logger.info(f"Dropped partitions older than {cutoff}: {expired}")
+        return {"cutoff": cutoff.isoformat(), "dropped_partitions": expired}
+
+    table = models.ArduinoData
+    deleted = delete_rows_before(engine, table, table.data_id, table.timestamp,
+                                 datetime(cutoff.year, cutoff.month, 1), chunk_size)
+    logger.info(f"Deleted {deleted} readings older than {cutoff}")
+    return {"cutoff": cutoff.isoformat(), "deleted_rows": deleted}
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Schema migrations and arduino_data partition maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("upgrade", help="apply pending migrations")
+    partition = commands.add_parser("partition", help="partition arduino_data by month (MySQL)")
+    partition.add_argument("--months-ahead", type=int, default=3)
+    retention = commands.add_parser("retention", help="drop data older than N months")
+    retention.add_argument("--keep-months", type=int, required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "upgrade":
+        run_migrations(engine)
+    elif args.command == "partition":
+        if not enable_monthly_partitioning(engine, args.months_ahead):
+            print("Added partitions:", ensure_future_partitions(engine, args.months_ahead))
+    else:
+        print(drop_expired_data(engine, args.keep_months))
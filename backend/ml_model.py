@@ -0,0 +1,101 @@
+from threading import Lock
+import os
+import time
+import logging
+
+import joblib
+
+from observability import ML_PREDICT_ROWS, ML_PREDICT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.getenv("ML_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rf_model.pkl"))
+
+
+class ModelRegistry:
+    """Keeps the RandomForest resident and reloads it when the file changes.
+
+    The pickle's mtime is checked at most once every `check_interval`
+    seconds, so swapping rf_model.pkl on disk takes effect without
+    restarting uvicorn.
+    """
+
+    def __init__(self, path: str = MODEL_PATH, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = Lock()
+        self._model = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self.loaded_at = None
+        self.load_seconds = None
+        self.load_count = 0
+        self.predict_calls = 0
+        self.predict_rows = 0
+        self.predict_seconds = 0.0
+        self.last_predict_seconds = None
+
+    def _load(self, mtime: float):
+        started = time.perf_counter()
+        model = joblib.load(self.path)
+        self.load_seconds = time.perf_counter() - started
+        self._model = model
+        self._mtime = mtime
+        self.loaded_at = time.time()
+        self.load_count += 1
+        logger.info(f"Model loaded from {self.path} in {self.load_seconds:.3f}s")
+
+    def get(self):
+        now = time.monotonic()
+        if self._model is not None and now - self._checked_at < self.check_interval:
+            return self._model
+
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                if self._model is None:
+                    raise
+                logger.warning(f"Model file {self.path} is not readable, keeping the loaded model.")
+                return self._model
+
+            if self._model is None or mtime != self._mtime:
+                try:
+                    self._load(mtime)
+                except Exception:
+                    # A half-written file during a swap must not take down scoring
+                    if self._model is None:
+                        raise
+                    logger.exception("Model reload failed, keeping the previous model.")
+            return self._model
+
+    def predict(self, features):
+        model = self.get()
+        started = time.perf_counter()
+        output = model.predict(features)
+        elapsed = time.perf_counter() - started
+        self.predict_calls += 1
+        self.predict_rows += len(features)
+        self.predict_seconds += elapsed
+        self.last_predict_seconds = elapsed
+        ML_PREDICT_SECONDS.observe(elapsed)
+        ML_PREDICT_ROWS.inc(amount=len(features))
+        return output
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "loaded": self._model is not None,
+            "loaded_at": self.loaded_at,
+            "file_mtime": self._mtime,
+            "load_count": self.load_count,
+            "load_seconds": self.load_seconds,
+            "predict_calls": self.predict_calls,
+            "predict_rows": self.predict_rows,
+            "predict_seconds_total": self.predict_seconds,
+            "last_predict_seconds": self.last_predict_seconds,
+        }
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,211 @@
+from datetime import datetime, timedelta
+import os
+import time
+import logging
+
+import numpy as np
+from sqlalchemy import insert, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from ml_model import model_registry
+from latest_cache import latest_prediction
+from rollups import device_filter, naive
+
+logger = logging.getLogger(__name__)
+
+PREDICT_CHUNK_SIZE = 10000
+WATERMARK_NAME = "aiOutput"
+# Ids are assigned before commit, so a reading can commit after ones with higher ids.
+# The watermark only moves past ids seen this long ago, when such readings have landed.
+ML_WATERMARK_SETTLE_SECONDS = float(os.getenv("ML_WATERMARK_SETTLE_SECONDS", "60"))
+
+# Optional scoring run triggered from receive_data, throttled to one per interval
+SCORE_ON_INGEST = os.getenv("ML_SCORE_ON_INGEST", "false").lower() in ("1", "true", "yes")
+SCORE_ON_INGEST_INTERVAL = float(os.getenv("ML_SCORE_ON_INGEST_INTERVAL", "60"))
+
+CATEGORIES = ["GOOD", "Moderate", "Unhealthy for Sensitive Groups",
+              "Unhealthy", "Very Unhealthy", "Hazardous"]
+
+_last_ingest_run = 0.0
+
+
+def get_season(month):
+    if month in [12, 1, 2]:
+        return 3
+    elif month in [3, 4, 5]:
+        return 2
+    elif month in [6, 7, 8]:
+        return 1
+    else:
+        return 0
+
+
+def classifier_features(temperature, humidity, pm25, pm10, timestamp):
+    """One input row of the category classifier; scoring and forecasts both build it here."""
+    return (temperature, humidity, pm25, pm10, get_season(timestamp.month))
+
+
+def predict_batch(features):
+    output = model_registry.predict(features)
+    return [CATEGORIES[int(label)] for label in output]
+
+
+def sensor_rows_query(db: Session):
+    return db.query(
+        models.ArduinoData.data_id,
+        models.ArduinoData.device_id,
+        models.ArduinoData.timestamp,
+        models.ArduinoData.temperature,
+        models.ArduinoData.humidity,
+        models.ArduinoData.pm25,
+        models.ArduinoData.pm10
+    )
+
+
+def score_rows(db: Session, sensor_data):
+    """Predict and insert aiOutput rows; the caller commits."""
+    # Score in fixed-size chunks: one predict call and one executemany per chunk
+    for offset in range(0, len(sensor_data), PREDICT_CHUNK_SIZE):
+        chunk = sensor_data[offset:offset + PREDICT_CHUNK_SIZE]
+
+        features = np.array([
+            classifier_features(row.temperature, row.humidity, row.pm25, row.pm10, row.timestamp)
+            for row in chunk
+        ], dtype=float)
+        labels = predict_batch(features)
+
+        db.execute(insert(models.AIOutput), [
+            {
+                "data_id": row.data_id,
+                "device_id": row.device_id,
+                "timestamp": row.timestamp,
+                "temperature": row.temperature,
+                "humidity": row.humidity,
+                "pm25": row.pm25,
+                "pm10": row.pm10,
+                "prediction": label,
+            }
+            for row, label in zip(chunk, labels)
+        ])
+    return len(sensor_data)
+
+
+def ensure_watermark(db: Session):
+    if db.get(models.MLWatermark, WATERMARK_NAME) is not None:
+        return
+
+    # First incremental run on a database that was already scored in full:
+    # start after the newest reading that already has a prediction.
+    last_data_id = 0
+    last_scored = db.query(func.max(models.AIOutput.timestamp)).scalar()
+    if last_scored is not None:
+        last_data_id = db.query(func.max(models.ArduinoData.data_id)).filter(
+            models.ArduinoData.timestamp <= last_scored
+        ).scalar() or 0
+
+    db.add(models.MLWatermark(name=WATERMARK_NAME, last_data_id=last_data_id))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Created by a concurrent first run
+        db.rollback()
+
+
+def _lock_watermark(db: Session):
+    """The watermark row, locked until commit; None while another run holds it."""
+    return db.query(models.MLWatermark).filter(
+        models.MLWatermark.name == WATERMARK_NAME
+    ).with_for_update(skip_locked=True).populate_existing().first()
+
+
+def unscored_rows_query(db: Session, after_data_id: int):
+    """Readings past `after_data_id` without a prediction, found by an anti-join on aiOutput.data_id."""
+    scored = select(models.AIOutput.data_id).where(models.AIOutput.data_id == models.ArduinoData.data_id)
+    return sensor_rows_query(db).filter(models.ArduinoData.data_id > after_data_id, ~scored.exists())
+
+
+def _settle_watermark(db: Session, watermark, started: datetime):
+    # Every reading was just looked at; one seen as newest a settle period before
+    # this run started has no lower ids left in flight
+    settled = started - timedelta(seconds=ML_WATERMARK_SETTLE_SECONDS)
+    if watermark.pending_data_id is not None and naive(watermark.pending_since) <= settled:
+        watermark.last_data_id = max(watermark.last_data_id, watermark.pending_data_id)
+        watermark.pending_data_id = watermark.pending_since = None
+    if watermark.pending_data_id is None:
+        newest = db.query(func.max(models.ArduinoData.data_id)).scalar() or 0
+        if newest > watermark.last_data_id:
+            watermark.pending_data_id, watermark.pending_since = newest, started
+
+
+def run_incremental_scoring(db: Session, start_time: datetime = None, end_time: datetime = None,
+                            device_id: int = None, now: datetime = None):
+    """Score readings without a prediction, optionally only those in [start_time, end_time] of `device_id`.
+
+    Readings up to the watermark are all scored, so only newer ones are
+    read, PREDICT_CHUNK_SIZE at a time, each chunk committed under the
+    watermark row lock. An unfiltered run that got through every reading
+    moves the watermark up to the newest id it saw ML_WATERMARK_SETTLE_SECONDS
+    before. Returns None when another run holds the watermark.
+    """
+    started = naive(now or datetime.utcnow())
+    ensure_watermark(db)
+    scored = 0
+    after = newest = None
+    try:
+        while True:
+            watermark = _lock_watermark(db)
+            if watermark is None:
+                db.rollback()
+                if after is None:
+                    return None
+                # Another run holds the watermark now and picks up the rest
+                return {"scored": scored, "last_data_id": newest}
+            if after is None:
+                after = watermark.last_data_id
+            query = unscored_rows_query(db, after)
+            if start_time is not None:
+                query = query.filter(models.ArduinoData.timestamp.between(start_time, end_time))
+            if device_id is not None:
+                query = query.filter(device_filter(models.ArduinoData, device_id))
+            chunk = query.order_by(models.ArduinoData.data_id).limit(PREDICT_CHUNK_SIZE).all()
+            if not chunk:
+                break
+            scored += score_rows(db, chunk)
+            after = newest = chunk[-1].data_id
+            db.commit()
+
+        if start_time is None and device_id is None:
+            _settle_watermark(db, watermark, started)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if scored:
+            # aiOutput ids come from an executemany, so the next read reloads the entry
+            latest_prediction.invalidate()
+    return {"scored": scored, "last_data_id": newest}
+
+
+def score_after_ingest():
+    """BackgroundTask for receive_data; a no-op unless ML_SCORE_ON_INGEST is set."""
+    global _last_ingest_run
+    if not SCORE_ON_INGEST:
+        return
+    now = time.monotonic()
+    if now - _last_ingest_run < SCORE_ON_INGEST_INTERVAL:
+        return
+    _last_ingest_run = now
+
+    db = SessionLocal()
+    try:
+        result = run_incremental_scoring(db)
+        if result:
+            logger.info(f"Incremental scoring after ingest: {result}")
+    except Exception:
+        logger.exception("Incremental scoring after ingest failed.")
+    finally:
+        db.close()
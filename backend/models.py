@@ -1,17 +1,36 @@
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON
+    Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON, Index, Text
 )
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
 Base = declarative_base()
 
+class Device(Base):
+    __tablename__ = 'devices'
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    owner_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    api_key_hash = Column(String(64), unique=True, index=True, nullable=False)  # sha256 of the key
+    is_active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_seen_at = Column(DateTime(timezone=True), nullable=True)
+
 class ArduinoData(Base):
     __tablename__ = 'arduino_data'
+    __table_args__ = (
+        Index('ix_arduino_data_timestamp', 'timestamp'),
+        Index('ix_arduino_data_device_timestamp', 'device_id', 'timestamp'),
+    )
 
     data_id = Column(Integer, primary_key=True, index=True)
+    # NULL for readings posted without a device key (single-sensor installs).
+    # No foreign key: partitioned MySQL tables cannot have one (error 1506), and
+    # migrated databases add the column without it as well.
+    device_id = Column(Integer, nullable=True)
     timestamp = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     temperature = Column(Float, nullable=False)
     humidity = Column(Float, nullable=False)
@@ -44,6 +63,11 @@ class UserSettings(Base):
 
 class Alert(Base):
     __tablename__ = 'alerts'
+    __table_args__ = (
+        # Cooldown lookup in ingest and the unacknowledged list, both newest first
+        Index('ix_alerts_user_type_timestamp', 'user_id', 'type', 'timestamp'),
+        Index('ix_alerts_user_ack_timestamp', 'user_id', 'acknowledged', 'timestamp'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
@@ -57,11 +81,119 @@ class Alert(Base):
 
 class AIOutput(Base):
     __tablename__ = 'aiOutput'
+    __table_args__ = (
+        Index('ix_aiOutput_timestamp', 'timestamp'),
+        Index('ix_aiOutput_device_timestamp', 'device_id', 'timestamp'),
+        # Finds unscored readings, and keeps a reading from being scored twice
+        Index('ix_aiOutput_data_id', 'data_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    # Plain column like arduino_data.device_id, matching migrated databases
+    device_id = Column(Integer, nullable=True)
+    # The scored reading; NULL for predictions made before it was recorded
+    data_id = Column(Integer, nullable=True)
     timestamp = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     temperature = Column(Float, nullable=True)
     humidity = Column(Float, nullable=True)
     pm25 = Column(Float, nullable=True)
     pm10 = Column(Float, nullable=True)
     prediction = Column(String(50), nullable=False)
+
+class MLWatermark(Base):
+    __tablename__ = 'ml_watermarks'
+
+    name = Column(String(50), primary_key=True)
+    # Every reading up to this id is scored
+    last_data_id = Column(Integer, nullable=False, default=0)
+    # Newest id when pending_since; last_data_id moves up to it once in-flight lower ids have settled
+    pending_data_id = Column(Integer, nullable=True)
+    pending_since = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class SensorRollupMixin:
+    # Running aggregates per device and bucket; avg and stddev are derived from sum/sum_sq/count.
+    # device_id 0 holds readings without a device.
+    @declared_attr
+    def __table_args__(cls):
+        return (Index(f'ix_{cls.__tablename__}_bucket', 'bucket'),)
+
+    device_id = Column(Integer, primary_key=True, default=0)
+    bucket = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    temperature_sum = Column(Float, nullable=False, default=0)
+    temperature_sum_sq = Column(Float, nullable=False, default=0)
+    temperature_min = Column(Float, nullable=True)
+    temperature_max = Column(Float, nullable=True)
+    humidity_sum = Column(Float, nullable=False, default=0)
+    humidity_sum_sq = Column(Float, nullable=False, default=0)
+    humidity_min = Column(Float, nullable=True)
+    humidity_max = Column(Float, nullable=True)
+    pm25_sum = Column(Float, nullable=False, default=0)
+    pm25_sum_sq = Column(Float, nullable=False, default=0)
+    pm25_min = Column(Float, nullable=True)
+    pm25_max = Column(Float, nullable=True)
+    pm10_sum = Column(Float, nullable=False, default=0)
+    pm10_sum_sq = Column(Float, nullable=False, default=0)
+    pm10_min = Column(Float, nullable=True)
+    pm10_max = Column(Float, nullable=True)
+    co2_sum = Column(Float, nullable=False, default=0)
+    co2_sum_sq = Column(Float, nullable=False, default=0)
+    co2_min = Column(Float, nullable=True)
+    co2_max = Column(Float, nullable=True)
+    voc_sum = Column(Float, nullable=False, default=0)
+    voc_sum_sq = Column(Float, nullable=False, default=0)
+    voc_min = Column(Float, nullable=True)
+    voc_max = Column(Float, nullable=True)
+
+class SensorRollupMinute(SensorRollupMixin, Base):
+    __tablename__ = 'arduino_rollup_1m'
+
+class SensorRollupHour(SensorRollupMixin, Base):
+    __tablename__ = 'arduino_rollup_1h'
+
+class SensorRollupDay(SensorRollupMixin, Base):
+    __tablename__ = 'arduino_rollup_1d'
+
+class AIForecast(Base):
+    # Precomputed pm25/pm10 forecasts, one row per issue hour and horizon.
+    # device_id 0 holds forecasts for readings without a device, as in the rollups.
+    __tablename__ = 'ai_forecasts'
+    __table_args__ = (
+        Index('ix_ai_forecasts_device_issued_horizon', 'device_id', 'issued_at', 'horizon', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(Integer, nullable=False, default=0)
+    issued_at = Column(DateTime, nullable=False)  # last complete hour the features cover
+    horizon = Column(Integer, nullable=False)  # hours ahead
+    target_time = Column(DateTime, nullable=False)
+    pm25 = Column(Float, nullable=False)
+    pm10 = Column(Float, nullable=False)
+    prediction = Column(String(50), nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class EmailOutbox(Base):
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        # The worker polls pending rows that are due
+        Index('ix_email_outbox_status_due', 'status', 'next_attempt_at'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    recipient = Column(String(255), nullable=False)
+    payload = Column(JSON, nullable=False)  # alert_info and thresholds for the template
+    status = Column(String(20), nullable=False, default="pending")  # pending | sent | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False)
+    applied_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+from threading import Event, Thread
+import os
+import time
+import logging
+
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from utils.email import ALERT_SUBJECT, SMTPMailer, render_alert_email
+
+logger = logging.getLogger(__name__)
+
+EMAIL_WORKER_ENABLED = os.getenv("EMAIL_WORKER", "true").lower() in ("1", "true", "yes")
+EMAIL_POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", "5"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "100"))
+EMAIL_RATE_PER_MINUTE = float(os.getenv("EMAIL_RATE_PER_MINUTE", "60"))
+# Alerts for one recipient queued within this window go out as a single digest
+EMAIL_DIGEST_SECONDS = float(os.getenv("EMAIL_DIGEST_SECONDS", "30"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30"))
+EMAIL_RETRY_MAX_SECONDS = 3600
+# A claimed row becomes due again after this long if its worker died mid-send
+EMAIL_LEASE_SECONDS = 300
+SMTP_MAX_IDLE_SECONDS = 60
+
+
+def enqueue_alert_email(db: Session, user_id: int, recipient: str, alert_info: dict, thresholds: dict):
+    """Queue an alert email in the caller's transaction, so it commits with the alerts."""
+    db.add(models.EmailOutbox(
+        user_id=user_id,
+        recipient=recipient,
+        payload={"alert_info": alert_info, "thresholds": thresholds},
+        status="pending",
+    ))
+
+
+def retry_delay(attempts: int):
+    return min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+
+
+class RateLimiter:
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+def claim_batch(db: Session, now: datetime):
+    """Lease the due rows of recipients whose oldest pending alert left the digest window."""
+    Outbox = models.EmailOutbox
+    due = Outbox.status == "pending", Outbox.next_attempt_at <= now
+    recipients = [row[0] for row in db.query(Outbox.recipient).filter(
+        *due, Outbox.created_at <= now - timedelta(seconds=EMAIL_DIGEST_SECONDS)
+    ).distinct().limit(EMAIL_BATCH_SIZE).all()]
+    if not recipients:
+        return []
+
+    # SKIP LOCKED lets several app workers drain the queue without sending twice
+    rows = db.query(Outbox).filter(*due, Outbox.recipient.in_(recipients)).order_by(
+        Outbox.id
+    ).limit(EMAIL_BATCH_SIZE).with_for_update(skip_locked=True).all()
+    for row in rows:
+        row.next_attempt_at = now + timedelta(seconds=EMAIL_LEASE_SECONDS)
+    db.commit()
+    return rows
+
+
+def send_batch(db: Session, mailer: SMTPMailer, limiter: RateLimiter):
+    """Send one claimed batch, one digest per recipient. Returns (sent, failed) row counts."""
+    rows = claim_batch(db, datetime.utcnow())
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.recipient, []).append(row)
+
+    sent = failed = 0
+    for recipient, group in groups.items():
+        alerts = [dict(row.payload["alert_info"], thresholds=row.payload["thresholds"]) for row in group]
+        limiter.wait()
+        try:
+            mailer.send(recipient, ALERT_SUBJECT, render_alert_email(alerts))
+        except Exception as e:
+            logger.warning(f"Alert email to {recipient} failed: {e}")
+            mailer.close()
+            now = datetime.utcnow()
+            for row in group:
+                row.attempts += 1
+                row.last_error = str(e)[:1000]
+                if row.attempts >= EMAIL_MAX_ATTEMPTS:
+                    row.status = "failed"
+                else:
+                    row.next_attempt_at = now + timedelta(seconds=retry_delay(row.attempts))
+            failed += len(group)
+        else:
+            now = datetime.utcnow()
+            for row in group:
+                row.status = "sent"
+                row.sent_at = now
+                row.last_error = None
+            sent += len(group)
+            logger.info(f"Alert email with {len(group)} alert(s) sent to {recipient}")
+        # Committed per recipient so a crash never resends a digest that went out
+        db.commit()
+    return sent, failed
+
+
+class EmailWorker:
+    """Background thread draining email_outbox over one reused SMTP connection."""
+
+    def __init__(self, session_factory=SessionLocal, poll_seconds: float = EMAIL_POLL_SECONDS):
+        self.session_factory = session_factory
+        self.poll_seconds = poll_seconds
+        self.mailer = SMTPMailer()
+        self.limiter = RateLimiter(EMAIL_RATE_PER_MINUTE)
+        self._stop = Event()
+        self._thread = None
+
+    def run_once(self):
+        """Drain everything that is due; returns (sent, failed) row counts."""
+        total_sent = total_failed = 0
+        db = self.session_factory()
+        try:
+            while not self._stop.is_set():
+                sent, failed = send_batch(db, self.mailer, self.limiter)
+                total_sent += sent
+                total_failed += failed
+                if not sent and not failed:
+                    break
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return total_sent, total_failed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Email worker iteration failed.")
+            self.mailer.close_if_idle(SMTP_MAX_IDLE_SECONDS)
+            self._stop.wait(self.poll_seconds)
+        self.mailer.close()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="email-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+email_worker = EmailWorker()
+
+
+if __name__ == "__main__":
+    # One drain against the configured server, e.g. a local stand-in:
+    # MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_STARTTLS=false MAIL_USE_CREDENTIALS=false
+    logging.basicConfig(level=logging.INFO)
+    print(email_worker.run_once())
+    email_worker.mailer.close()
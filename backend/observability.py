@@ -0,0 +1,247 @@
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+import atexit
+import logging
+import os
+import queue
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Requests issuing more queries than this are logged, to surface N+1 loops
+QUERY_COUNT_WARNING = int(os.getenv("QUERY_COUNT_WARNING", "50"))
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+# Logging
+
+_listener = None
+
+def configure_logging(level: str = LOG_LEVEL, log_file: str = LOG_FILE):
+    """Route all records through a queue; file and console writes happen on a listener thread."""
+    global _listener
+    if _listener is not None:
+        return
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Flushes whatever is still queued when the process exits
+    atexit.register(_listener.stop)
+
+
+# Metrics
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series[len(self.buckets)]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[len(self.buckets)]}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time: `collect()` returns {label values tuple: value}."""
+
+    def __init__(self, name: str, help_text: str, collect, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+        self.label_names = tuple(label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception:
+            logger.exception(f"Collecting {self.name} failed.")
+            return lines
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status")))
+HTTP_REQUEST_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements issued per request", ("method", "route"), COUNT_BUCKETS))
+HTTP_REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request", ("method", "route")))
+DB_QUERIES = registry.register(Counter("db_queries_total", "SQL statements executed", ("engine",)))
+DB_QUERY_SECONDS = registry.register(Histogram("db_query_duration_seconds", "SQL statement latency", ("engine",)))
+ML_PREDICT_SECONDS = registry.register(Histogram("ml_predict_duration_seconds", "Model predict call latency"))
+ML_PREDICT_ROWS = registry.register(Counter("ml_predict_rows_total", "Rows scored by the model"))
+
+
+# Per-request SQL accounting; the handler's threadpool worker sees the same object
+class _RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats = ContextVar("request_stats", default=None)
+_engines = {}  # label -> Engine, for pool gauges
+
+
+def instrument_engine(engine, label: str = "sync"):
+    """Count and time every statement on `engine` (pass async_engine.sync_engine for async)."""
+    if label in _engines:
+        return
+    _engines[label] = engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERIES.inc(label)
+        DB_QUERY_SECONDS.observe(elapsed, label)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+
+def _pool_stats():
+    values = {}
+    for label, engine in _engines.items():
+        pool = engine.pool
+        for name in ("size", "checkedout", "overflow", "checkedin"):
+            if hasattr(pool, name):
+                values[(label, name)] = getattr(pool, name)()
+    return values
+
+
+registry.register(Gauge("db_pool_connections", "Connection pool state", _pool_stats, ("engine", "state")))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request by its route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = _RequestStats()
+        token = _request_stats.set(stats)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners cannot blow up cardinality
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.observe(elapsed, method, path, status[0])
+            HTTP_REQUEST_QUERIES.observe(stats.queries, method, path)
+            HTTP_REQUEST_DB_SECONDS.observe(stats.db_seconds, method, path)
+            if stats.queries > QUERY_COUNT_WARNING:
+                logger.warning(f"{method} {path} issued {stats.queries} SQL statements ({stats.db_seconds * 1000:.1f} ms)")
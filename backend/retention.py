@@ -0,0 +1,123 @@
+from datetime import timedelta
+from threading import Event, Thread
+import argparse
+import os
+import logging
+
+from sqlalchemy import delete, func, select
+
+import models
+import rollups
+from database import engine
+from migrations import delete_rows_before, drop_partitions_before, list_partitions
+
+logger = logging.getLogger(__name__)
+
+RETENTION_SCHEDULER = os.getenv("RETENTION_SCHEDULER", "false").lower() in ("1", "true", "yes")
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+# Rows per delete transaction, and the pause between them, keep lock hold times short
+RETENTION_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "5000"))
+RETENTION_CHUNK_PAUSE_MS = float(os.getenv("RETENTION_CHUNK_PAUSE_MS", "50"))
+# Predictions follow the raw readings they were scored from unless set separately
+AI_OUTPUT_RETENTION_DAYS = int(os.getenv("AI_OUTPUT_RETENTION_DAYS", str(rollups.RAW_RETENTION_DAYS)))
+# Delivered alert emails are only kept for troubleshooting; failed ones stay until handled
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "30"))
+
+
+def _delete_buckets_before(engine, rollup, cutoff):
+    """Delete rollup buckets older than `cutoff` one day of buckets per transaction."""
+    with engine.connect() as conn:
+        oldest = conn.execute(select(func.min(rollup.bucket)).where(rollup.bucket < cutoff)).scalar()
+    deleted = 0
+    day = rollups.floor_day(oldest) if oldest is not None else cutoff
+    while day < cutoff:
+        upper = min(day + timedelta(days=1), cutoff)
+        with engine.begin() as conn:
+            deleted += conn.execute(delete(rollup).where(rollup.bucket >= day, rollup.bucket < upper)).rowcount
+        day = upper
+    return deleted
+
+
+def run_retention(engine=engine, chunk_size: int = RETENTION_CHUNK_SIZE):
+    """Drop raw rows, fine rollups and sent emails past their horizons.
+
+    Rollups are maintained at ingest, so older readings are already
+    compacted into hourly and daily buckets and this only has to delete.
+    Range queries read the coarser rollups past each horizon.
+    """
+    pause = RETENTION_CHUNK_PAUSE_MS / 1000
+    result = {}
+
+    raw_cutoff = rollups.horizon(None)
+    if raw_cutoff is not None:
+        table = models.ArduinoData
+        if list_partitions(engine):
+            # Whole months go as partitions; the rest of the cutoff month row by row
+            result["dropped_partitions"] = drop_partitions_before(engine, raw_cutoff.date())
+        result["arduino_data"] = delete_rows_before(
+            engine, table, table.data_id, table.timestamp, raw_cutoff, chunk_size, pause
+        )
+
+    ai_cutoff = rollups.retention_cutoff(AI_OUTPUT_RETENTION_DAYS)
+    if ai_cutoff is not None:
+        table = models.AIOutput
+        result["aiOutput"] = delete_rows_before(engine, table, table.id, table.timestamp, ai_cutoff, chunk_size, pause)
+
+    outbox_cutoff = rollups.retention_cutoff(EMAIL_OUTBOX_RETENTION_DAYS)
+    if outbox_cutoff is not None:
+        table = models.EmailOutbox
+        # sent_at is only set once a message went out
+        result["email_outbox"] = delete_rows_before(
+            engine, table, table.id, table.sent_at, outbox_cutoff, chunk_size, pause
+        )
+
+    for rollup, _, _ in rollups.RESOLUTIONS:
+        cutoff = rollups.horizon(rollup)
+        if cutoff is not None:
+            result[rollup.__tablename__] = _delete_buckets_before(engine, rollup, cutoff)
+
+    if result:
+        logger.info(f"Retention run removed: {result}")
+    return result
+
+
+class RetentionScheduler:
+    """Background thread running the retention pass every `interval` seconds."""
+
+    def __init__(self, interval: float = RETENTION_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                run_retention()
+            except Exception:
+                logger.exception("Retention run failed.")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+retention_scheduler = RetentionScheduler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply RAW_RETENTION_DAYS and rollup retention once")
+    parser.add_argument("--chunk-size", type=int, default=RETENTION_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(run_retention(engine, args.chunk_size))
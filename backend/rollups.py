@@ -0,0 +1,411 @@
+from datetime import datetime, timedelta, timezone
+import math
+import os
+import logging
+
+import numpy as np
+from sqlalchemy import func, select, union_all
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+METRICS = ["temperature", "humidity", "pm25", "pm10", "co2", "voc"]
+# Rollup key for readings stored without a device
+UNASSIGNED_DEVICE = 0
+
+# Days of raw readings and of minute/hour rollups kept by retention.py; 0 keeps them.
+# Older ranges are read from the next coarser rollup; daily rollups are never removed.
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "0"))
+MINUTE_ROLLUP_RETENTION_DAYS = int(os.getenv("MINUTE_ROLLUP_RETENTION_DAYS", "0"))
+HOUR_ROLLUP_RETENTION_DAYS = int(os.getenv("HOUR_ROLLUP_RETENTION_DAYS", "0"))
+# Longest span of raw rows read for exact percentiles; longer ranges keep their newest part
+PERCENTILE_MAX_DAYS = float(os.getenv("PERCENTILE_MAX_DAYS", "31"))
+
+
+def floor_minute(ts):
+    return ts.replace(second=0, microsecond=0)
+
+def floor_hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def floor_day(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _ceil(ts, floor, step):
+    floored = floor(ts)
+    return floored if floored == ts else floored + step
+
+
+# (rollup table, bucket floor, bucket width), finest first
+RESOLUTIONS = [
+    (models.SensorRollupMinute, floor_minute, timedelta(minutes=1)),
+    (models.SensorRollupHour, floor_hour, timedelta(hours=1)),
+    (models.SensorRollupDay, floor_day, timedelta(days=1)),
+]
+
+
+def naive(ts):
+    # DATETIME columns keep the wall-clock value and drop the offset,
+    # so buckets and range edges are compared the same way
+    return ts.replace(tzinfo=None) if ts.tzinfo else ts
+
+
+def _retention_days():
+    """Effective days kept per source (None = raw rows), finest first.
+
+    A coarser source never expires before a finer one, so data past a
+    horizon is always available one level up. None means kept forever.
+    """
+    sources = [None] + [rollup for rollup, _, _ in RESOLUTIONS]
+    configured = [RAW_RETENTION_DAYS, MINUTE_ROLLUP_RETENTION_DAYS, HOUR_ROLLUP_RETENTION_DAYS, 0]
+    days = []
+    keep = 0
+    for value in configured:
+        keep = None if keep is None or value <= 0 else max(keep, value)
+        days.append(keep)
+    return list(zip(sources, days))
+
+
+def retention_cutoff(days, now=None):
+    """Start of the oldest day kept when keeping `days` days; None keeps everything."""
+    if not days or days <= 0:
+        return None
+    now = naive(now or datetime.now(timezone.utc))
+    return floor_day(now - timedelta(days=days))
+
+
+def horizon(source, now=None):
+    """Oldest bucket start `source` still holds under retention; None when nothing expires.
+
+    Horizons fall on day boundaries, so every rollup bucket is either
+    entirely before or entirely after one.
+    """
+    return retention_cutoff(dict(_retention_days())[source], now)
+
+
+def source_floor(source):
+    for rollup, floor, _ in RESOLUTIONS:
+        if rollup is source:
+            return floor
+    return None
+
+
+def retained_pieces(source, lower, upper):
+    """Split [lower, upper) of `source` so the part past its horizon comes from coarser rollups.
+
+    Returned oldest first; rollup pieces start on a bucket boundary.
+    """
+    levels = [level for level, _ in _retention_days()]
+    index = levels.index(source)
+    pieces = []
+    while True:
+        level = levels[index]
+        cutoff = horizon(level)
+        if cutoff is None or cutoff <= lower or index == len(levels) - 1:
+            pieces.insert(0, (level, lower, upper))
+            break
+        if cutoff < upper:
+            pieces.insert(0, (level, cutoff, upper))
+            upper = cutoff
+        index += 1
+    return [
+        (level, source_floor(level)(piece_lower) if level is not None else piece_lower, piece_upper)
+        for level, piece_lower, piece_upper in pieces
+    ]
+
+
+def compacted(start):
+    """Whether raw readings from `start` on may already have been removed."""
+    cutoff = horizon(None)
+    return start is not None and cutoff is not None and naive(start) < cutoff
+
+
+def _field(reading, name):
+    return reading[name] if isinstance(reading, dict) else getattr(reading, name)
+
+
+def _device(reading):
+    device_id = reading.get("device_id") if isinstance(reading, dict) else reading.device_id
+    return device_id or UNASSIGNED_DEVICE
+
+
+def aggregate(readings, floor):
+    buckets = {}
+    for reading in readings:
+        key = (_device(reading), floor(naive(_field(reading, "timestamp"))))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {"device_id": key[0], "bucket": key[1], "count": 0}
+            for metric in METRICS:
+                bucket[f"{metric}_sum"] = 0.0
+                bucket[f"{metric}_sum_sq"] = 0.0
+                bucket[f"{metric}_min"] = None
+                bucket[f"{metric}_max"] = None
+        bucket["count"] += 1
+        for metric in METRICS:
+            value = float(_field(reading, metric))
+            bucket[f"{metric}_sum"] += value
+            bucket[f"{metric}_sum_sq"] += value * value
+            if bucket[f"{metric}_min"] is None or value < bucket[f"{metric}_min"]:
+                bucket[f"{metric}_min"] = value
+            if bucket[f"{metric}_max"] is None or value > bucket[f"{metric}_max"]:
+                bucket[f"{metric}_max"] = value
+    return list(buckets.values())
+
+
+def _merge_row(existing, row):
+    existing.count += row["count"]
+    for metric in METRICS:
+        setattr(existing, f"{metric}_sum", getattr(existing, f"{metric}_sum") + row[f"{metric}_sum"])
+        setattr(existing, f"{metric}_sum_sq", getattr(existing, f"{metric}_sum_sq") + row[f"{metric}_sum_sq"])
+        current_min = getattr(existing, f"{metric}_min")
+        current_max = getattr(existing, f"{metric}_max")
+        setattr(existing, f"{metric}_min", row[f"{metric}_min"] if current_min is None else min(current_min, row[f"{metric}_min"]))
+        setattr(existing, f"{metric}_max", row[f"{metric}_max"] if current_max is None else max(current_max, row[f"{metric}_max"]))
+
+
+def _upsert(db: Session, rollup, rows):
+    table = rollup.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        new = stmt.inserted
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        new = stmt.excluded
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(table)
+        new = stmt.excluded
+    else:
+        # No native upsert: merge through the ORM
+        for row in rows:
+            existing = db.get(rollup, (row["device_id"], row["bucket"]))
+            if existing is None:
+                db.add(rollup(**row))
+            else:
+                _merge_row(existing, row)
+        db.flush()
+        return
+
+    # SQLite's two-argument min()/max() are scalar, like LEAST/GREATEST elsewhere
+    least = func.min if dialect == "sqlite" else func.least
+    greatest = func.max if dialect == "sqlite" else func.greatest
+
+    updates = {"count": table.c["count"] + new["count"]}
+    for metric in METRICS:
+        updates[f"{metric}_sum"] = table.c[f"{metric}_sum"] + new[f"{metric}_sum"]
+        updates[f"{metric}_sum_sq"] = table.c[f"{metric}_sum_sq"] + new[f"{metric}_sum_sq"]
+        updates[f"{metric}_min"] = least(table.c[f"{metric}_min"], new[f"{metric}_min"])
+        updates[f"{metric}_max"] = greatest(table.c[f"{metric}_max"], new[f"{metric}_max"])
+
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(updates)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=[table.c.device_id, table.c.bucket], set_=updates)
+    db.execute(stmt, rows)
+
+
+def apply_readings(db: Session, readings):
+    """Fold new readings (dicts or ArduinoData rows) into every rollup; the caller commits."""
+    if not readings:
+        return
+    for rollup, floor, _ in RESOLUTIONS:
+        _upsert(db, rollup, aggregate(readings, floor))
+
+
+def rebuild_rollups(db: Session, chunk_size: int = 10000):
+    """Recompute rollups from arduino_data (backfill for existing data).
+
+    Under raw retention only buckets from the raw horizon on are rebuilt;
+    older ones exist nowhere else anymore.
+    """
+    since = horizon(None)
+    for rollup, _, _ in RESOLUTIONS:
+        query = db.query(rollup)
+        if since is not None:
+            query = query.filter(rollup.bucket >= since)
+        query.delete(synchronize_session=False)
+
+    last_id = 0
+    total = 0
+    while True:
+        # Keyset pagination keeps memory flat on large tables
+        query = db.query(models.ArduinoData).filter(models.ArduinoData.data_id > last_id)
+        if since is not None:
+            query = query.filter(models.ArduinoData.timestamp >= since)
+        chunk = query.order_by(models.ArduinoData.data_id).limit(chunk_size).all()
+        if not chunk:
+            break
+        apply_readings(db, chunk)
+        last_id = chunk[-1].data_id
+        total += len(chunk)
+        db.expunge_all()
+
+    db.commit()
+    logger.info(f"Rollups rebuilt from {total} readings.")
+    return total
+
+
+def backfill_if_empty(db: Session):
+    has_rollups = db.query(models.SensorRollupMinute.bucket).first() is not None
+    if has_rollups:
+        return
+    if db.query(models.ArduinoData.data_id).first() is not None:
+        rebuild_rollups(db)
+
+
+def plan_segments(start, end):
+    """Split [start, end] into (source, lower, upper) pieces.
+
+    Source is None for raw rows at the partial edges, otherwise a rollup
+    table; the coarsest buckets that fit entirely inside the range are used.
+    The last raw piece includes `end` itself, matching BETWEEN.
+    """
+    lower, upper = start, end
+    segments = []
+    tail = []
+    prev_source = None
+    for rollup, floor, step in RESOLUTIONS:
+        inner_lower = _ceil(lower, floor, step)
+        inner_upper = floor(upper)
+        if inner_lower >= inner_upper:
+            break
+        segments.append((prev_source, lower, inner_lower))
+        tail.insert(0, (prev_source, inner_upper, upper))
+        lower, upper = inner_lower, inner_upper
+        prev_source = rollup
+    segments.append((prev_source, lower, upper))
+    return segments + tail
+
+
+def device_filter(model, device_id):
+    """Rows of one device in arduino_data or aiOutput; device 0 matches rows stored without one."""
+    if device_id == UNASSIGNED_DEVICE:
+        return model.device_id.is_(None)
+    return model.device_id == device_id
+
+
+def _segment_select(source, lower, upper, inclusive, metrics, device_id=None):
+    if source is None:
+        ts = models.ArduinoData.timestamp
+        columns = [func.count().label("n")]
+        for metric in metrics:
+            column = getattr(models.ArduinoData, metric)
+            columns += [
+                func.sum(column).label(f"{metric}_sum"),
+                func.sum(column * column).label(f"{metric}_sum_sq"),
+                func.min(column).label(f"{metric}_min"),
+                func.max(column).label(f"{metric}_max"),
+            ]
+        upper_clause = ts <= upper if inclusive else ts < upper
+        query = select(*columns).where(ts >= lower, upper_clause)
+        if device_id is not None:
+            query = query.where(device_filter(models.ArduinoData, device_id))
+        return query
+
+    columns = [func.sum(source.count).label("n")]
+    for metric in metrics:
+        columns += [
+            func.sum(getattr(source, f"{metric}_sum")).label(f"{metric}_sum"),
+            func.sum(getattr(source, f"{metric}_sum_sq")).label(f"{metric}_sum_sq"),
+            func.min(getattr(source, f"{metric}_min")).label(f"{metric}_min"),
+            func.max(getattr(source, f"{metric}_max")).label(f"{metric}_max"),
+        ]
+    query = select(*columns).where(source.bucket >= lower, source.bucket < upper)
+    if device_id is not None:
+        query = query.where(source.device_id == device_id)
+    return query
+
+
+def range_stats(db: Session, start, end, metrics=METRICS, device_id=None):
+    """min/max/avg/stddev_pop per metric over [start, end], from rollups plus raw edges.
+
+    `device_id` limits the result to one device; None covers all of them.
+    """
+    start, end = naive(start), naive(end)
+    planned = plan_segments(start, end)
+    segments = []
+    for index, (source, lower, upper) in enumerate(planned):
+        if lower >= upper and index < len(planned) - 1:
+            continue
+        for piece in retained_pieces(source, lower, upper):
+            # Neighbouring pieces moved to the same rollup are read as one range,
+            # so an edge bucket is never counted twice
+            if segments and piece[0] is not None and segments[-1][0] is piece[0]:
+                segments[-1] = (piece[0], segments[-1][1], piece[2])
+            else:
+                segments.append(piece)
+    selects = [
+        _segment_select(source, lower, upper, index == len(segments) - 1, metrics, device_id)
+        for index, (source, lower, upper) in enumerate(segments)
+    ]
+    rows = db.execute(union_all(*selects) if len(selects) > 1 else selects[0]).all()
+
+    count = sum(row.n or 0 for row in rows)
+    result = {}
+    for metric in metrics:
+        mins = [row._mapping[f"{metric}_min"] for row in rows if row._mapping[f"{metric}_min"] is not None]
+        maxs = [row._mapping[f"{metric}_max"] for row in rows if row._mapping[f"{metric}_max"] is not None]
+        if not count:
+            result[metric] = {"count": 0, "min": None, "max": None, "avg": None, "stddev": None}
+            continue
+        total = sum(row._mapping[f"{metric}_sum"] or 0 for row in rows)
+        total_sq = sum(row._mapping[f"{metric}_sum_sq"] or 0 for row in rows)
+        avg = total / count
+        result[metric] = {
+            "count": count,
+            "min": min(mins),
+            "max": max(maxs),
+            "avg": avg,
+            "stddev": math.sqrt(max(total_sq / count - avg * avg, 0.0)),
+        }
+    return result
+
+
+def percentile_window(start, end):
+    """Part of [start, end] range_percentiles reads: raw rows still retained, at most PERCENTILE_MAX_DAYS."""
+    start, end = naive(start), naive(end)
+    lower = max(start, end - timedelta(days=PERCENTILE_MAX_DAYS))
+    cutoff = horizon(None)
+    if cutoff is not None:
+        lower = max(lower, cutoff)
+    return lower, end
+
+
+def range_percentiles(db: Session, start, end, metrics=METRICS, percentiles=(50, 95, 99), device_id=None):
+    """Exact percentiles per metric over `percentile_window(start, end)`.
+
+    Rollups cannot answer these, so raw rows are read; the window keeps
+    that to the retained rows of a bounded span.
+    """
+    lower, upper = percentile_window(start, end)
+    columns = [getattr(models.ArduinoData, metric) for metric in metrics]
+    query = select(*columns).where(models.ArduinoData.timestamp.between(lower, upper))
+    if device_id is not None:
+        query = query.where(device_filter(models.ArduinoData, device_id))
+    rows = db.execute(query).all()
+    if not rows:
+        return {metric: {f"p{p}": None for p in percentiles} for metric in metrics}
+
+    values = np.array(rows, dtype=float)
+    result = {}
+    for index, metric in enumerate(metrics):
+        computed = np.percentile(values[:, index], percentiles)
+        result[metric] = {f"p{p}": float(value) for p, value in zip(percentiles, computed)}
+    return result
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Rebuilt rollups from {rebuild_rollups(session)} readings.")
+    finally:
+        session.close()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class SensorData(BaseModel):
@@ -10,6 +10,8 @@ class SensorData(BaseModel):
     pm10: float
     co2: float
     voc: float
+    # Taken from the device key on ingest, never from the body
+    device_id: Optional[int] = None
     class Config:
         from_attributes = True
 
@@ -23,6 +25,33 @@ class PartialSensorData(BaseModel):
     class Config:
         from_attributes = True
 
+class SensorBucket(SensorData):
+    # Set only for downsampled responses; raw rows leave them out
+    samples: Optional[int] = None
+    temperature_min: Optional[float] = None
+    temperature_max: Optional[float] = None
+    humidity_min: Optional[float] = None
+    humidity_max: Optional[float] = None
+    pm25_min: Optional[float] = None
+    pm25_max: Optional[float] = None
+    pm10_min: Optional[float] = None
+    pm10_max: Optional[float] = None
+    co2_min: Optional[float] = None
+    co2_max: Optional[float] = None
+    voc_min: Optional[float] = None
+    voc_max: Optional[float] = None
+
+class PartialSensorBucket(PartialSensorData):
+    samples: Optional[int] = None
+    temperature_min: Optional[float] = None
+    temperature_max: Optional[float] = None
+    humidity_min: Optional[float] = None
+    humidity_max: Optional[float] = None
+    pm25_min: Optional[float] = None
+    pm25_max: Optional[float] = None
+    pm10_min: Optional[float] = None
+    pm10_max: Optional[float] = None
+
 class UserSettings(BaseModel):
     notifications: bool
     format: str
@@ -45,6 +74,10 @@ class Alert(BaseModel):
     class Config:
         from_attributes = True
 
+class AlertPage(BaseModel):
+    items: List[Alert]
+    next_cursor: Optional[str] = None
+
 class AlertAcknowledgeRequest(BaseModel):
     alert_id: int    
 
@@ -70,6 +103,7 @@ class AIOutputBase(BaseModel):
     pm25: float
     pm10: float
     prediction: str
+    device_id: Optional[int] = None
     class Config:
         from_attributes = True
 
@@ -77,4 +111,33 @@ class AIOutput(AIOutputBase):
     id: int
 
     class Config:
-        from_attributes = True  # V2'de from_attributes olabilir, uyarı alırsan güncellersin
\ No newline at end of file
+        from_attributes = True  # V2'de from_attributes olabilir, uyarı alırsan güncellersin
+
+class ForecastPoint(BaseModel):
+    horizon: int
+    target_time: datetime
+    pm25: float
+    pm10: float
+    prediction: str
+
+class Forecast(BaseModel):
+    device_id: int
+    issued_at: datetime
+    forecasts: List[ForecastPoint]
+
+class DeviceCreate(BaseModel):
+    name: str
+
+class DeviceOut(BaseModel):
+    id: int
+    name: str
+    is_active: bool
+    created_at: Optional[datetime] = None
+    last_seen_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class DeviceWithKey(DeviceOut):
+    # Only returned when the key is created or rotated; the server keeps a hash
+    api_key: str
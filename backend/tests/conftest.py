@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+# Settings are read at import time, so they are fixed before any app module loads
+_db_dir = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_dir}/test.db")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("MAIL_SERVER", "localhost")
+os.environ.setdefault("MAIL_FROM", "alerts@example.com")
+os.environ.setdefault("EMAIL_WORKER", "false")
+os.environ.setdefault("FORECAST_SCHEDULER", "false")
+os.environ.setdefault("LOG_FILE", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import models
+from database import SessionLocal, engine
+
+
+@pytest.fixture
+def db():
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
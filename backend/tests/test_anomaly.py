@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
+import anomaly
+
+
+def _reading(timestamp, device_id=7):
+    return {"timestamp": timestamp, "device_id": device_id, "pm25": 12.0}
+
+
+def _dropouts(detections):
+    return [detection for detection in detections if detection["type"] == "dropout"]
+
+
+def test_backfilled_gaps_are_not_dropouts():
+    detector = anomaly.AnomalyDetector(warmup=3)
+    now = datetime.now(timezone.utc)
+    # A day of history with an hour missing in the middle, uploaded in one batch
+    history = [now - timedelta(days=1) + timedelta(minutes=index) for index in range(60)]
+    history += [history[-1] + timedelta(hours=1, minutes=index) for index in range(60)]
+    assert _dropouts(detector.observe_many([_reading(ts) for ts in history], now)) == []
+    assert detector._devices.get(7) is None
+
+    # Live readings still learn the interval and report a gap
+    live = [now - timedelta(seconds=100 - 10 * index) for index in range(5)]
+    assert _dropouts(detector.observe_many([_reading(ts) for ts in live], now)) == []
+    later = now + timedelta(minutes=20)
+    assert [d["value"] for d in _dropouts(detector.observe(_reading(later), later))] == [
+        (later - live[-1]).total_seconds()]
+
+
+def test_backfill_does_not_reset_the_sweeper():
+    detector = anomaly.AnomalyDetector(warmup=3)
+    now = datetime.now(timezone.utc)
+    live = [now - timedelta(seconds=50 - 10 * index) for index in range(5)]
+    detector.observe_many([_reading(ts) for ts in live], now)
+    arrived = detector._devices[7].arrived
+    assert len(detector.sweep(arrived + 600)) == 1
+
+    # Late readings from before the outage and older history arrive while the device is still silent
+    detector.observe_many([_reading(live[1] - timedelta(seconds=5)), _reading(now - timedelta(hours=2))], now)
+    assert detector._devices[7].silent
+    assert detector.sweep(arrived + 1200) == []
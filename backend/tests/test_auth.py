@@ -0,0 +1,39 @@
+from fastapi.testclient import TestClient
+
+import auth
+import main
+import models
+
+
+def _login(client, email, password="secret"):
+    client.post("/auth/register", json={"email": email, "password": password})
+    token = client.post("/auth/login", data={"username": email, "password": password}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_settings_update_invalidates_cached_principal(db):
+    client = TestClient(main.app)
+    headers = _login(client, "owner@example.com")
+    assert client.get("/auth/me", headers=headers).status_code == 200
+    assert "owner@example.com" in auth.principal_cache._entries
+
+    response = client.post("/api/settings", headers=headers, json={
+        "notifications": False, "format": "metric", "thresholds": {"co2": 900, "pm25": 30, "pm10": 45, "voc": 400},
+    })
+    assert response.status_code == 200
+    assert "owner@example.com" not in auth.principal_cache._entries
+
+
+def test_invalidated_token_claims_are_checked_against_the_database(db):
+    client = TestClient(main.app)
+    headers = _login(client, "former@example.com")
+    assert client.get("/auth/me", headers=headers).status_code == 200
+
+    user = db.query(models.User).filter(models.User.email == "former@example.com").one()
+    user.is_active = False
+    db.commit()
+    # The token still says active; only the cache entry and claims stand in the way
+    assert client.get("/auth/me", headers=headers).status_code == 200
+
+    auth.principal_cache.invalidate("former@example.com")
+    assert client.get("/auth/me", headers=headers).status_code == 401
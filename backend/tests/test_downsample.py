@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+import downsample
+import models
+import rollups
+
+
+def _add_readings(db, start, count, step):
+    rows = []
+    for index in range(count):
+        rows.append({
+            "timestamp": start + index * step,
+            "temperature": 20 + index % 3,
+            "humidity": 40 + index % 7,
+            "pm25": 10 + index % 11,
+            "pm10": 15 + index % 13,
+            "co2": 400 + index % 17,
+            "voc": 50 + index % 5,
+        })
+    db.execute(insert(models.ArduinoData), rows)
+    rollups.apply_readings(db, rows)
+    db.commit()
+    return rows
+
+
+@pytest.mark.parametrize("mode", downsample.MODES)
+@pytest.mark.parametrize("max_points", [2, 3, 7, 10, 50, 299])
+def test_series_never_exceeds_max_points(db, mode, max_points):
+    # Off the epoch grid and long enough for rollup buckets to be read at the edges
+    start = datetime(2025, 3, 1, 0, 7, 13)
+    rows = _add_readings(db, start, 3000, timedelta(seconds=37))
+    end = rows[-1]["timestamp"]
+
+    series = downsample.downsample(db, start, end, ["pm25", "co2"], max_points=max_points, mode=mode)
+    assert 0 < len(series) <= max_points
+    if mode != "lttb":
+        assert sum(point["samples"] for point in series) == len(rows)
+
+
+def test_folded_edge_buckets_keep_every_sample(db):
+    start = datetime(2025, 3, 1, 0, 7, 13)
+    rows = _add_readings(db, start, 600, timedelta(seconds=61))
+    width = timedelta(minutes=7)
+
+    unbounded = downsample.bucket_series(db, start, rows[-1]["timestamp"], width, ["pm25"], with_minmax=True)
+    bounded = downsample.bucket_series(db, start, rows[-1]["timestamp"], width, ["pm25"], with_minmax=True,
+                                       max_points=len(unbounded) - 2)
+    assert len(bounded) == len(unbounded) - 2
+    assert sum(point["samples"] for point in bounded) == sum(point["samples"] for point in unbounded)
+    assert min(point["pm25_min"] for point in bounded) == min(point["pm25_min"] for point in unbounded)
+    assert bounded[1:] == unbounded[3:]
+
+
+def test_lttb_below_three_points_keeps_the_ends():
+    points = [{"timestamp": datetime(2025, 3, 1) + timedelta(minutes=index), "pm25": index} for index in range(10)]
+    assert downsample.lttb(points, 2, "pm25") == [points[0], points[-1]]
+    assert downsample.lttb(points, 1, "pm25") == [points[0]]
+    assert len(downsample.lttb(points, 5, "pm25")) == 5
+    assert downsample.lttb(points[:2], 5, "pm25") == points[:2]
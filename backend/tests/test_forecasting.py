@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+import models
+import forecasting
+from rollups import METRICS
+
+
+def _add_hours(db, start, hours, device_id=0):
+    for index in range(hours):
+        bucket = start + timedelta(hours=index)
+        row = models.SensorRollupHour(device_id=device_id, bucket=bucket, count=2)
+        for position, metric in enumerate(METRICS):
+            value = index * (position + 1) + (index % 5)
+            setattr(row, f"{metric}_sum", 2 * value)
+            setattr(row, f"{metric}_sum_sq", 2 * value * value)
+            setattr(row, f"{metric}_min", value)
+            setattr(row, f"{metric}_max", value)
+        db.add(row)
+    db.commit()
+
+
+def _training_series(db, device_id=0):
+    rollup = models.SensorRollupHour
+    return {row.bucket: forecasting.hourly_means(row)
+            for row in db.query(rollup).filter(rollup.device_id == device_id)}
+
+
+def test_cached_window_features_match_training(db):
+    start = datetime(2025, 3, 1)
+    _add_hours(db, start, 40)
+    cache = forecasting.HourlyWindowCache()
+
+    # The newest bucket is still filling, so the anchor is the hour before it
+    latest = start + timedelta(hours=39)
+    anchor = forecasting._anchor(latest, latest + timedelta(minutes=30))
+    assert anchor == latest - timedelta(hours=1)
+    served = forecasting.feature_vector(cache.refresh(db, 0, anchor), anchor)
+    assert served == forecasting.feature_vector(_training_series(db), anchor)
+
+    # A later run tops the cached window up instead of reloading it
+    _add_hours(db, start + timedelta(hours=40), 3)
+    anchor = start + timedelta(hours=41)
+    served = forecasting.feature_vector(cache.refresh(db, 0, anchor), anchor)
+    assert served == forecasting.feature_vector(_training_series(db), anchor)
@@ -0,0 +1,50 @@
+from fastapi.testclient import TestClient
+
+import ingest_buffer
+import latest_cache
+import main
+import models
+
+
+def _reading(timestamp, pm25):
+    return {"timestamp": timestamp, "temperature": 21.0, "humidity": 40.0, "pm25": pm25, "pm10": 20.0,
+            "co2": 500.0, "voc": 100.0}
+
+
+def test_batch_mixing_naive_and_offset_timestamps(db):
+    latest_cache.latest_reading.invalidate()
+    client = TestClient(main.app)
+    response = client.post("/api/sensors/data/batch", json=[
+        _reading("2025-03-01T11:00:00", 12.0),
+        _reading("2025-03-01T11:05:00+03:00", 30.0),
+        _reading("2025-03-01T10:55:00Z", 18.0),
+    ])
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 3
+    assert db.query(models.ArduinoData).count() == 3
+    assert latest_cache.latest_reading.fresh().data["pm25"] == 30.0
+
+
+def test_write_behind_publishes_after_the_flush_commits(db, monkeypatch):
+    buffered, published, scored = [], [], []
+    monkeypatch.setattr(ingest_buffer, "INGEST_WRITE_BEHIND", True)
+    monkeypatch.setattr(main.write_behind, "put", buffered.append)
+    monkeypatch.setattr(main, "score_after_ingest", lambda: scored.append(True))
+    original_publish = main.publish_live
+
+    def publish_live(reading, alerts):
+        published.append(db.query(models.ArduinoData).count())
+        original_publish(reading, alerts)
+    monkeypatch.setattr(main, "publish_live", publish_live)
+
+    client = TestClient(main.app)
+    for pm25 in (12.0, 14.0):
+        response = client.post("/api/sensors/data", json=_reading("2025-03-01T11:00:00", pm25))
+        assert response.json()["buffered"] is True
+    assert published == [] and scored == []
+
+    main.flush_buffered_readings(buffered)
+    # Both rows were already committed when the first one was published
+    assert published == [2, 2]
+    assert scored == [True]
+    assert latest_cache.latest_reading.fresh().data["pm25"] == 14.0
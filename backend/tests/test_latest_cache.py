@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+import latest_cache
+import models
+
+
+def _reading(timestamp, **extra):
+    return {"timestamp": timestamp, "temperature": 21.0, "humidity": 40.0, "pm25": 12.5, "pm10": 20.0,
+            "co2": 500.0, "voc": 100.0, **extra}
+
+
+def test_put_and_cold_load_share_an_etag(db):
+    cache = latest_cache.LatestCache(latest_cache._load_latest_reading, latest_cache.schemas.SensorData)
+    written = _reading(datetime(2025, 3, 1, 14, 30, tzinfo=timezone(timedelta(hours=3))), device_id=None)
+    db.add(models.ArduinoData(**{**written, "timestamp": datetime(2025, 3, 1, 14, 30)}))
+    db.commit()
+
+    cache.put(written)
+    assert cache.fresh().data["timestamp"] == datetime(2025, 3, 1, 14, 30)
+    put_etag = cache.fresh().etag
+    cache.invalidate()
+    assert cache.get(db).etag == put_etag
+
+
+def test_unassigned_reading_refreshes_device_zero(db):
+    cache = latest_cache.LatestCache(latest_cache._load_latest_reading, latest_cache.schemas.SensorData)
+    db.add(models.ArduinoData(**_reading(datetime(2025, 3, 1, 11, 0))))
+    db.commit()
+    stale = cache.get(db, 0)
+
+    cache.put(_reading(datetime(2025, 3, 1, 11, 5)))
+    assert cache.fresh(0).etag != stale.etag
+    assert cache.fresh(0).etag == cache.fresh(None).etag
+    assert cache.fresh(0).data["timestamp"] == datetime(2025, 3, 1, 11, 5)
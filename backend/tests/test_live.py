@@ -0,0 +1,31 @@
+import asyncio
+
+import live
+
+
+class _IdleClient:
+    """A websocket whose client reads one event, then closes without sending anything."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed = asyncio.Event()
+
+    async def send_json(self, data):
+        self.sent.append(data)
+        self.closed.set()
+
+    async def receive(self):
+        await self.closed.wait()
+        return {"type": "websocket.disconnect", "code": 1000}
+
+
+def test_idle_websocket_unsubscribes_on_close():
+    async def run():
+        subscriber = live.broadcaster.subscribe()
+        client = _IdleClient()
+        # Nothing is published after the first event, so only the receive side can end the stream
+        await asyncio.wait_for(live.websocket_stream(client, subscriber, [{"event": "reading", "data": {}}]), 5)
+        return client.sent
+
+    assert asyncio.run(run()) == [{"event": "reading", "data": {}}]
+    assert live.broadcaster.subscriber_count == 0
@@ -0,0 +1,68 @@
+from sqlalchemy import (
+    Boolean, Column, DateTime, Float, ForeignKey, Integer, JSON, MetaData, String, Table, create_engine, inspect,
+    text,
+)
+
+import migrations
+import models
+
+
+def _baseline_schema(engine):
+    """Tables as the first release created them, before any migration."""
+    metadata = MetaData()
+    Table("arduino_data", metadata,
+          Column("data_id", Integer, primary_key=True, index=True),
+          Column("timestamp", DateTime(timezone=True), nullable=False),
+          *[Column(metric, Float, nullable=False) for metric in ("temperature", "humidity", "pm25", "pm10", "co2", "voc")])
+    Table("users", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("email", String(60), unique=True, index=True),
+          Column("hashed_password", String(255), nullable=False),
+          Column("is_active", Boolean))
+    Table("user_settings", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("notifications", Integer, nullable=False),
+          Column("format", String(50), nullable=False),
+          Column("thresholds", JSON, nullable=False),
+          Column("user_id", Integer, ForeignKey("users.id")))
+    Table("alerts", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("timestamp", DateTime(timezone=True)),
+          Column("type", String(50), nullable=False),
+          Column("value", Float, nullable=False),
+          Column("threshold", Float, nullable=False),
+          Column("acknowledged", Boolean),
+          Column("user_id", Integer, ForeignKey("users.id")))
+    Table("aiOutput", metadata,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("timestamp", DateTime(timezone=True), nullable=False),
+          *[Column(metric, Float) for metric in ("temperature", "humidity", "pm25", "pm10")],
+          Column("prediction", String(50), nullable=False))
+    metadata.create_all(engine)
+
+
+def test_baseline_database_upgrades_to_the_current_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/baseline.db")
+    _baseline_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO arduino_data (timestamp, temperature, humidity, pm25, pm10, co2, voc) "
+            "VALUES ('2025-03-01 00:00:00', 20, 40, 10, 15, 400, 50)"
+        ))
+
+    migrations.run_migrations(engine)
+
+    inspector = inspect(engine)
+    for table in models.Base.metadata.tables.values():
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert {column.name for column in table.columns} <= columns, table.name
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= indexes, table.name
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT device_id FROM arduino_data")).all() == [(None,)]
+        assert conn.execute(text("SELECT version FROM schema_migrations ORDER BY version")).scalars().all() == [
+            version for version, _, _ in migrations.MIGRATIONS
+        ]
+
+    # A second start applies nothing
+    migrations.run_migrations(engine)
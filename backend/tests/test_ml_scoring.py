@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import main
+import ml_scoring
+import models
+
+
+def _reading(timestamp, index, **extra):
+    return {"timestamp": timestamp, "temperature": 20, "humidity": 40, "pm25": 5 + index, "pm10": 10 + index,
+            "co2": 400, "voc": 50, **extra}
+
+
+def _add_readings(db, start, count, **extra):
+    db.execute(insert(models.ArduinoData), [
+        _reading(start + timedelta(minutes=index), index, **extra) for index in range(count)
+    ])
+    db.commit()
+
+
+def _scored_ids(db):
+    return sorted(data_id for (data_id,) in db.query(models.AIOutput.data_id))
+
+
+def test_window_and_device_narrow_the_run_and_nothing_is_scored_twice(db, monkeypatch):
+    monkeypatch.setattr(ml_scoring, "PREDICT_CHUNK_SIZE", 4)
+    start = datetime(2025, 3, 1)
+    _add_readings(db, start, 25)
+    _add_readings(db, start, 5, device_id=7)
+    client = TestClient(main.app)
+    window = {"start_time": (start + timedelta(minutes=5)).isoformat(),
+              "end_time": (start + timedelta(minutes=9)).isoformat()}
+
+    assert client.post("/ml/process", params=window).json()["scored"] == 5
+    assert client.post("/ml/process", params=window).json()["scored"] == 0
+    assert client.post("/ml/process", params={"device_id": 7}).json()["scored"] == 5
+    assert client.post("/ml/process", params={"start_time": window["start_time"]}).status_code == 400
+
+    assert client.post("/ml/process").json()["scored"] == 20
+    assert _scored_ids(db) == list(range(1, 31))
+
+
+def test_reading_committed_out_of_id_order_is_still_scored(db):
+    start = datetime(2025, 3, 1)
+    now = datetime(2025, 3, 2)
+    settle = timedelta(seconds=ml_scoring.ML_WATERMARK_SETTLE_SECONDS)
+    # Id 3 is assigned but its transaction has not committed yet
+    db.execute(insert(models.ArduinoData), [_reading(start, index, data_id=index) for index in (1, 2, 4, 5)])
+    db.commit()
+
+    assert ml_scoring.run_incremental_scoring(db, now=now)["scored"] == 4
+    watermark = db.get(models.MLWatermark, ml_scoring.WATERMARK_NAME)
+    assert (watermark.last_data_id, watermark.pending_data_id) == (0, 5)
+
+    db.execute(insert(models.ArduinoData), [_reading(start, 3, data_id=3)])
+    db.commit()
+    assert ml_scoring.run_incremental_scoring(db, now=now + settle)["scored"] == 1
+    db.refresh(watermark)
+    assert (watermark.last_data_id, watermark.pending_data_id) == (5, None)
+    assert _scored_ids(db) == [1, 2, 3, 4, 5]
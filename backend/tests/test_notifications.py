@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+from email import message_from_bytes, policy
+import socketserver
+import threading
+
+import pytest
+
+import models
+import notifications
+import utils.email
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: no TLS, no auth, every message kept in memory."""
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        sink = self.server.sink
+        sink.connections += 1
+        self.reply("220 sink ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.decode().strip()[:4].upper()
+            if verb in ("EHLO", "HELO", "RSET", "NOOP"):
+                recipients = []
+                self.reply("250 ok")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("550 mailbox unavailable" if sink.reject else "250 ok")
+            elif verb == "RCPT":
+                recipients.append(line.decode().split(":", 1)[1].strip().strip("<>"))
+                self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                data = b""
+                for body_line in iter(self.rfile.readline, b""):
+                    if body_line == b".\r\n":
+                        break
+                    data += body_line[1:] if body_line.startswith(b"..") else body_line
+                sink.messages.append((recipients, message_from_bytes(data, policy=policy.default)))
+                self.reply("250 queued")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+@pytest.fixture
+def smtp_sink(monkeypatch):
+    server = _SMTPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.sink = sink = type("Sink", (), {})()
+    sink.connections, sink.messages, sink.reject = 0, [], False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setenv("MAIL_SERVER", "127.0.0.1")
+    monkeypatch.setenv("MAIL_PORT", str(server.server_address[1]))
+    monkeypatch.setattr(utils.email, "MAIL_STARTTLS", False)
+    monkeypatch.setattr(utils.email, "MAIL_SSL_TLS", False)
+    monkeypatch.setattr(utils.email, "MAIL_USE_CREDENTIALS", False)
+    try:
+        yield sink
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def worker(smtp_sink):
+    worker = notifications.EmailWorker()
+    worker.limiter = notifications.RateLimiter(0)
+    try:
+        yield worker
+    finally:
+        worker.mailer.close()
+
+
+def _queue(db, recipient, pm25, age=timedelta(minutes=5)):
+    created = datetime.utcnow() - age
+    alert_info = {"timestamp": created.strftime("%Y-%m-%d %H:%M:%S"), "co2": 500, "pm25": pm25, "pm10": 20,
+                  "voc": 100, "temperature": 21, "humidity": 40}
+    row = models.EmailOutbox(recipient=recipient, payload={"alert_info": alert_info, "thresholds": {"pm25": 35}},
+                             status="pending", created_at=created, next_attempt_at=created)
+    db.add(row)
+    db.commit()
+    return row
+
+
+def test_digests_are_delivered_over_one_connection(db, smtp_sink, worker):
+    _queue(db, "first@example.com", 41.5)
+    _queue(db, "first@example.com", 57.25)
+    _queue(db, "second@example.com", 88.75)
+    # Still inside the digest window, so it waits for more alerts
+    _queue(db, "third@example.com", 99.5, age=timedelta(seconds=1))
+
+    assert worker.run_once() == (3, 0)
+    assert smtp_sink.connections == 1
+    delivered = {recipients[0]: message for recipients, message in smtp_sink.messages}
+    assert sorted(delivered) == ["first@example.com", "second@example.com"]
+    digest = delivered["first@example.com"].get_content()
+    assert "41.5" in digest and "57.25" in digest
+    assert delivered["first@example.com"]["Subject"] == utils.email.ALERT_SUBJECT
+
+    statuses = {row.recipient: row.status for row in db.query(models.EmailOutbox)}
+    assert statuses == {"first@example.com": "sent", "second@example.com": "sent", "third@example.com": "pending"}
+
+    # The next drain keeps using the open connection
+    _queue(db, "second@example.com", 61.0)
+    assert worker.run_once() == (1, 0)
+    assert (smtp_sink.connections, len(smtp_sink.messages)) == (1, 3)
+
+
+def test_rejected_email_is_retried_until_failed(db, smtp_sink, worker, monkeypatch):
+    monkeypatch.setattr(notifications, "EMAIL_MAX_ATTEMPTS", 2)
+    row = _queue(db, "owner@example.com", 41.5)
+    smtp_sink.reject = True
+
+    assert worker.run_once() == (0, 1)
+    db.refresh(row)
+    assert (row.status, row.attempts) == ("pending", 1)
+    assert row.next_attempt_at > datetime.utcnow()
+    assert "550" in row.last_error
+
+    # Due again: the second rejection uses up the attempts
+    row.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert worker.run_once() == (0, 1)
+    db.refresh(row)
+    assert (row.status, row.attempts) == ("failed", 2)
+    assert smtp_sink.messages == []
+    # A failed send drops the connection so the next one starts clean
+    assert smtp_sink.connections == 2
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+import models
+import retention
+from database import engine
+
+
+def _outbox_row(status, sent_at, created_at):
+    return models.EmailOutbox(recipient="user@example.com", payload={}, status=status, sent_at=sent_at,
+                              created_at=created_at, next_attempt_at=created_at)
+
+
+def test_sent_emails_are_purged_after_the_outbox_horizon(db):
+    now = datetime.utcnow()
+    old = now - timedelta(days=retention.EMAIL_OUTBOX_RETENTION_DAYS + 2)
+    db.add_all([
+        _outbox_row("sent", old, old),
+        _outbox_row("sent", now, now),
+        _outbox_row("failed", None, old),
+        _outbox_row("pending", None, old),
+    ])
+    db.commit()
+
+    assert retention.run_retention(engine)["email_outbox"] == 1
+    db.expire_all()
+    remaining = sorted(row.status for row in db.query(models.EmailOutbox))
+    assert remaining == ["failed", "pending", "sent"]
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+import models
+import rollups
+
+
+def test_percentiles_read_only_the_bounded_window(db, monkeypatch):
+    monkeypatch.setattr(rollups, "PERCENTILE_MAX_DAYS", 2)
+    end = datetime(2025, 3, 10)
+    # One reading a day, pm25 equal to its day number
+    db.execute(insert(models.ArduinoData), [{
+        "timestamp": end - timedelta(days=days),
+        "temperature": 20, "humidity": 40, "pm25": days, "pm10": 10, "co2": 400, "voc": 50,
+    } for days in range(10)])
+    db.commit()
+
+    start = end - timedelta(days=9)
+    assert rollups.percentile_window(start, end) == (end - timedelta(days=2), end)
+    result = rollups.range_percentiles(db, start, end, ["pm25"], percentiles=(0, 100))
+    assert result["pm25"] == {"p0": 0.0, "p100": 2.0}
+
+
+def test_percentile_window_starts_at_the_raw_retention_horizon(monkeypatch):
+    monkeypatch.setattr(rollups, "RAW_RETENTION_DAYS", 7)
+    now = datetime.utcnow()
+    lower, upper = rollups.percentile_window(now - timedelta(days=20), now)
+    assert lower == rollups.horizon(None) > now - timedelta(days=8)
+    assert upper == now
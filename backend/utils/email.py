@@ -1,53 +1,90 @@
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
+from email.message import EmailMessage
 from jinja2 import Environment, FileSystemLoader
+import smtplib
+import time
 import os
 import logging
 
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=int(os.getenv("MAIL_PORT")),
-    MAIL_SERVER=os.getenv("MAIL_SERVER"),
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True,
-    TEMPLATE_FOLDER="templates"
-)
-
-async def send_alert_email(user_email: str, alert_info: dict, thresholds: dict):
-    logger.info("E-mail gönderme işlemi başlatıldı...")
-
-    try:
-        env = Environment(loader=FileSystemLoader("templates"))
-        template = env.get_template("email_alert.html")
-
-        html = template.render(
-            timestamp=alert_info["timestamp"],
-            co2=alert_info["co2"],
-            pm25=alert_info["pm25"],
-            pm10=alert_info["pm10"],
-            voc=alert_info["voc"],
-            temperature=alert_info["temperature"],
-            humidity=alert_info["humidity"],
-            thresholds=thresholds
-        )
-
-        message = MessageSchema(
-            subject="⚠️ Hava Kalitesi Alarmı",
-            recipients=[user_email],
-            body=html,
-            subtype="html"
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message)
-        logger.info(f"E-mail başarıyla gönderildi: {user_email}")
-
-    except Exception as e:
-        logger.error(f"E-mail gönderimi sırasında bir hata oluştu: {e}")
-        logger.exception("Hata Detayı: ")
+
+def _env_bool(name: str, default: bool):
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ("1", "true", "yes")
+
+
+# STARTTLS and credentials can be switched off to point at a local stand-in SMTP server
+MAIL_STARTTLS = _env_bool("MAIL_STARTTLS", True)
+MAIL_SSL_TLS = _env_bool("MAIL_SSL_TLS", False)
+MAIL_USE_CREDENTIALS = _env_bool("MAIL_USE_CREDENTIALS", True)
+
+ALERT_SUBJECT = "⚠️ Hava Kalitesi Alarmı"
+
+# Parsed once per process instead of on every message
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+template_env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+alert_template = template_env.get_template("email_alert.html")
+
+
+def render_alert_email(alerts: list):
+    """`alerts` holds alert_info dicts with their "thresholds"; more than one renders a digest."""
+    return alert_template.render(alerts=alerts)
+
+
+class SMTPMailer:
+    """Sends over one SMTP connection, reconnecting when the server has dropped it."""
+
+    def __init__(self):
+        self.server = os.getenv("MAIL_SERVER")
+        self.port = int(os.getenv("MAIL_PORT", "465" if MAIL_SSL_TLS else "587"))
+        self.sender = os.getenv("MAIL_FROM")
+        self.username = os.getenv("MAIL_USERNAME")
+        self.password = os.getenv("MAIL_PASSWORD")
+        self.timeout = float(os.getenv("MAIL_TIMEOUT", "30"))
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        if MAIL_SSL_TLS:
+            smtp = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+            if MAIL_STARTTLS:
+                smtp.starttls()
+        if MAIL_USE_CREDENTIALS:
+            smtp.login(self.username, self.password)
+        self._smtp = smtp
+
+    def send(self, recipient: str, subject: str, html: str):
+        message = EmailMessage()
+        message["Subject"] = subject
+        message["From"] = self.sender
+        message["To"] = recipient
+        message.set_content(html, subtype="html")
+
+        for attempt in range(2):
+            if self._smtp is None:
+                self._connect()
+            try:
+                self._smtp.send_message(message)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # Idle connections get closed by the server; retry once on a new one
+                self._smtp = None
+                if attempt:
+                    raise
+
+    def close_if_idle(self, max_idle: float):
+        if self._smtp is not None and time.monotonic() - self._last_used > max_idle:
+            self.close()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._smtp = None
 
@@ -37,6 +37,20 @@ export const analyticsApi = {
     return response.json();
   },
   
+  // Get statistics for several metrics with a single request
+  async getMultiMetricStats(metricIds: string[], start: string, end: string): Promise<Record<string, SensorStatistics>> {
+    const url = `${API_URL}/api/stats/multi?metrics=${metricIds.join(',')}&start=${start}&end=${end}`;
+    
+    const response = await fetchWithAuth(url);
+    
+    if (!response.ok) {
+      throw new Error(`Failed to fetch statistics for ${metricIds.join(', ')}`);
+    }
+    
+    const data = await response.json();
+    return data.metrics;
+  },
+  
   // Format statistics for presentation
   formatStats(stats: SensorStatistics) {
     return {
@@ -23,14 +23,31 @@ export const sensorApi = {
     return response.json();
   },
 
+  // Subscribe to readings pushed by the server (Server-Sent Events)
+  subscribeToLiveData(onReading: (data: any) => void): EventSource {
+    const source = new EventSource(`${API_URL}/api/sensors/stream`);
+    source.addEventListener('reading', (event) => {
+      onReading(JSON.parse((event as MessageEvent).data));
+    });
+    return source;
+  },
+
   // Get historical sensor data with optional date range
-  async getHistoricalData(start?: string, end?: string) {
-    let url = `${API_URL}/api/sensors/history`;
+  // maxPoints asks the server to bucket the range into at most that many points
+  async getHistoricalData(start?: string, end?: string, maxPoints?: number) {
+    const params = new URLSearchParams();
     
     // Add date range parameters if provided
     if (start && end) {
-      url += `?start=${start}&end=${end}`;
+      params.append('start', start);
+      params.append('end', end);
     }
+    if (maxPoints) {
+      params.append('max_points', String(maxPoints));
+    }
+    
+    const query = params.toString();
+    const url = `${API_URL}/api/sensors/history${query ? `?${query}` : ''}`;
     
     const response = await fetchWithAuth(url);
     
@@ -154,8 +154,8 @@ const Analytics = () => {
     fetchData();
   }, [dateRange, t]);
 
-  // Fetch statistics from API for selected metrics
-  const fetchStats = async (metricId: string) => {
+  // Fetch statistics from API for all selected metrics in one request
+  const fetchStats = async (metricIds: string[]) => {
     try {
       const end = new Date();
       const start = subDays(end, Number(dateRange) - 1);
@@ -168,13 +168,15 @@ const Analytics = () => {
       const formattedStart = turkishStartDate.toISOString().split('T')[0] + 'T00:00:00';
       const formattedEnd = turkishEndDate.toISOString().split('T')[0] + 'T23:59:59';
       
-      const statsData = await analyticsApi.getMetricStats(metricId, formattedStart, formattedEnd);
+      const statsData = await analyticsApi.getMultiMetricStats(metricIds, formattedStart, formattedEnd);
       
-      return analyticsApi.formatStats(statsData);
+      return Object.fromEntries(
+        metricIds.map(metricId => [metricId, analyticsApi.formatStats(statsData[metricId])])
+      );
     } catch (err) {
-      console.error(`Error fetching stats for ${metricId}:`, err);
+      console.error(`Error fetching stats for ${metricIds.join(', ')}:`, err);
       // Fall back to calculated stats from the current data set
-      return calculateStats(metricId);
+      return Object.fromEntries(metricIds.map(metricId => [metricId, calculateStats(metricId)]));
     }
   };
 
@@ -204,11 +206,7 @@ const Analytics = () => {
   // Fetch stats for selected metrics when they change
   useEffect(() => {
     const getStatsForMetrics = async () => {
-      const stats = {};
-      
-      for (const metricId of selectedMetrics) {
-        stats[metricId] = await fetchStats(metricId);
-      }
+      const stats = await fetchStats(selectedMetrics);
       
       setMetricStats(stats);
     };
@@ -61,10 +61,25 @@ const Dashboard = () => {
     
     fetchCurrentData();
     
-    // Refresh data every 30 seconds
-    const intervalId = setInterval(fetchCurrentData, 30000);
+    // New readings are pushed by the server; poll every 30 seconds only if the stream fails
+    let intervalId: ReturnType<typeof setInterval> | undefined;
+    const source = sensorApi.subscribeToLiveData((data) => {
+      setCurrentData(data);
+      setError(null);
+    });
+    source.onerror = () => {
+      source.close();
+      if (!intervalId) {
+        intervalId = setInterval(fetchCurrentData, 30000);
+      }
+    };
     
-    return () => clearInterval(intervalId);
+    return () => {
+      source.close();
+      if (intervalId) {
+        clearInterval(intervalId);
+      }
+    };
   }, [t]); // Add t as a dependency to update when language changes
 
   // Fetch historical sensor data for the last 24 hours
@@ -81,8 +96,8 @@ const Dashboard = () => {
         const formattedStartDate = convertToTurkishTime(startDate);
         const formattedEndDate = convertToTurkishTime(endDate);
         
-        // Pass date range to API
-        const data = await sensorApi.getHistoricalData(formattedStartDate, formattedEndDate);
+        // Pass date range to API, averaged into at most 180 points on the server
+        const data = await sensorApi.getHistoricalData(formattedStartDate, formattedEndDate, 180);
         
         // Format the data for the chart
         const formattedData = data.map(record => ({